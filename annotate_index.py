@@ -3,7 +3,16 @@ Read index sequence(s) from standard in and echo back to standard out with
 a comma-separated list of matching and close-matching index names
 """
 import sys
-from index_definitions import BASIC_LOOKUP
+import threading
+from index_registry import BASIC_LOOKUP, get_names, get_lengths
+from index_neighbourhood import get_registry_index
+from lru_cache import LRUCache
+
+# Maximum pattern length for the bit-parallel Levenshtein distance.
+WORD_SIZE = 64
+
+# Maximum number of pairwise distances kept by 'cached_distance'.
+DISTANCE_CACHE_SIZE = 100000
 
 def hamming_distance(s1, s2, shortest=False):
     """Calculate the Hamming distance between two strings.
@@ -25,6 +34,26 @@ def levenshtein_distance(s1, s2, shortest=False):
     If 'shortest' is True, then check the strings up to the length of
     the shortest of them.
     If 'shortest' is False, compare the strings as they are.
+    Uses the bit-parallel algorithm if either string is at most
+    WORD_SIZE characters long, else the dynamic programming algorithm.
+    """
+    if shortest and len(s1) != len(s2):
+        length = min(len(s1), len(s2))
+        s1 = s1[:length]
+        s2 = s2[:length]
+    if len(s1) <= WORD_SIZE:
+        return bitparallel_levenshtein_distance(s1, s2)
+    elif len(s2) <= WORD_SIZE:
+        return bitparallel_levenshtein_distance(s2, s1)
+    else:
+        return dp_levenshtein_distance(s1, s2)
+
+def dp_levenshtein_distance(s1, s2, shortest=False):
+    """Calculate the Levenshtein distance between two strings by dynamic
+    programming. This is the reference implementation.
+    If 'shortest' is True, then check the strings up to the length of
+    the shortest of them.
+    If 'shortest' is False, compare the strings as they are.
     From http://en.wikibooks.org/wiki/Algorithm_implementation/Strings/Levenshtein_distance#Python 4th version.
     """
     if shortest and len(s1) != len(s2):
@@ -42,29 +71,328 @@ def levenshtein_distance(s1, s2, shortest=False):
             thisrow[y] = min(delcost, addcost, subcost)
     return thisrow[len(s2) - 1]
 
+def bitparallel_levenshtein_distance(pattern, text):
+    """Calculate the Levenshtein distance between two strings using the
+    bit-vector algorithm of Myers (1999), in the formulation of Hyyro
+    (2001). One column of the dynamic programming table is encoded as
+    bit-vectors of its vertical deltas, so each character of the text
+    takes a constant number of integer operations. Intended for patterns
+    of at most WORD_SIZE characters.
+    """
+    length = len(pattern)
+    if length == 0:
+        return len(text)
+    peq = dict()                        # Key: char, value: match positions
+    bit = 1
+    for ch in pattern:
+        peq[ch] = peq.get(ch, 0) | bit
+        bit <<= 1
+    full = (1 << length) - 1
+    last = 1 << (length - 1)
+    pv = full                           # Positive vertical deltas
+    mv = 0                              # Negative vertical deltas
+    score = length
+    for ch in text:
+        eq = peq.get(ch, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & full)
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        ph = ((ph << 1) | 1) & full     # Top row increases by 1 per column
+        mh = (mh << 1) & full
+        pv = mh | (~(xv | ph) & full)
+        mv = ph & xv
+    return score
+
+def within(s1, s2, k, shortest=False):
+    """Is the Levenshtein distance between two strings at most k?
+    If 'shortest' is True, then check the strings up to the length of
+    the shortest of them.
+    Gives the same answer as 'levenshtein_distance(s1, s2) <= k', but only
+    computes the diagonal band of width k of the table, and stops as soon
+    as all values in a row exceed k.
+    """
+    if shortest and len(s1) != len(s2):
+        length = min(len(s1), len(s2))
+        s1 = s1[:length]
+        s2 = s2[:length]
+    if k < 0:
+        return False
+    if abs(len(s1) - len(s2)) > k:
+        return False
+    infinity = k + 1
+    # Row x holds the distances between s1[:x] and s2[:y] for y=0..len(s2);
+    # values outside the band are 'infinity', as they must exceed k.
+    thisrow = range(min(len(s2), k) + 1) + [infinity] * (len(s2) - k)
+    for x in xrange(1, len(s1) + 1):
+        oneago = thisrow
+        start = max(1, x - k)
+        end = min(len(s2), x + k)
+        thisrow = [infinity] * (len(s2) + 1)
+        if x <= k:
+            thisrow[0] = x
+        minimum = thisrow[0]
+        for y in xrange(start, end + 1):
+            value = min(oneago[y] + 1,
+                        thisrow[y - 1] + 1,
+                        oneago[y - 1] + (s1[x - 1] != s2[y - 1]))
+            if value > infinity:
+                value = infinity
+            thisrow[y] = value
+            if value < minimum:
+                minimum = value
+        if minimum > k:
+            return False
+    return thisrow[len(s2)] <= k
+
+DISTANCES = dict(hamming=hamming_distance,
+                 levenshtein=levenshtein_distance)
 
-if __name__ == '__main__':
+DISTANCE_CACHE = LRUCache(DISTANCE_CACHE_SIZE)
+_distance_lock = threading.Lock()
+
+def cached_distance(s1, s2, metric='hamming', shortest=False):
+    """Return the distance between two strings by the given metric,
+    'hamming' or 'levenshtein', memoized in the shared DISTANCE_CACHE.
+    The distances are symmetric, so the pair is cached in either order.
+    """
+    try:
+        function = DISTANCES[metric]
+    except KeyError:
+        raise ValueError("unknown metric %s" % metric)
+    if s2 < s1:
+        s1, s2 = s2, s1
+    key = (s1, s2, metric, shortest)
+    with _distance_lock:
+        result = DISTANCE_CACHE.get(key)
+    if result is None:
+        result = function(s1, s2, shortest=shortest)
+        with _distance_lock:
+            DISTANCE_CACHE.set(key, result)
+    return result
 
-    mismatches = 1
-    for record in sys.stdin:
-        index = None
-        for col in record.strip().split():
-            col = col.upper()
-            if len([c for c in col if c not in "ACGTN-"]) > 0:
-                continue
-            index = col
-            break
+
+class BKTree(object):
+    """Burkhard-Keller tree of sequences: a metric tree that allows finding
+    all sequences within a given distance of a query sequence while
+    visiting only a fraction of them. The distance function must be a
+    metric, such as the Levenshtein distance of the full strings."""
+
+    def __init__(self, sequences=[], distance=levenshtein_distance):
+        self.distance = distance
+        self.root = None                # Node: [sequence, {distance: node}]
+        self.count = 0
+        for sequence in sequences:
+            self.add(sequence)
+
+    def __len__(self):
+        return self.count
+
+    def add(self, sequence):
+        "Add the sequence to the tree, unless already in it."
+        if self.root is None:
+            self.root = [sequence, dict()]
+            self.count += 1
+            return
+        node = self.root
+        while True:
+            dist = self.distance(sequence, node[0])
+            if dist == 0: return
+            try:
+                node = node[1][dist]
+            except KeyError:
+                node[1][dist] = [sequence, dict()]
+                self.count += 1
+                return
+
+    def search(self, sequence, max_distance):
+        """Return the list of tuples (sequence, distance) for all sequences
+        in the tree within the given distance of the sequence,
+        sorted by distance and sequence."""
+        result = []
+        if self.root is None: return result
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            dist = self.distance(sequence, node[0])
+            if dist <= max_distance:
+                result.append((node[0], dist))
+            # By the triangle inequality, only the children at distance
+            # within max_distance of dist can contain matches.
+            for child_dist, child in node[1].iteritems():
+                if dist - max_distance <= child_dist <= dist + max_distance:
+                    stack.append(child)
+        result.sort(key=lambda r: (r[1], r[0]))
+        return result
+
+
+_registry_tree = None
+
+def get_registry_tree():
+    "Return the shared BK-tree of the registry sequences."
+    global _registry_tree
+    if _registry_tree is None:
+        _registry_tree = BKTree(sorted(BASIC_LOOKUP.values()))
+    return _registry_tree
+
+def search_registry(sequence, max_distance):
+    """Return the list of tuples (index name, Levenshtein distance) for all
+    registry indexes within the given edit distance of the sequence."""
+    result = []
+    for found, dist in get_registry_tree().search(sequence, max_distance):
+        result.extend([(name, dist) for name in get_names(found)])
+    return result
+
+
+def get_index(record):
+    """Return the first column of the record that looks like an index
+    sequence, upper-cased, or None."""
+    for col in record.split():
+        col = col.upper()
+        if len([c for c in col if c not in "ACGTN-"]) > 0:
+            continue
+        return col
+    return None
+
+def annotate(index, mismatches):
+    """Return the list of comma-separated names of the registry indexes
+    at 0, 1,... up to the given number of mismatches from the index."""
+    names = [[] for i in xrange(mismatches+1)]
+    for sequence, dist in get_registry_index().get(index, mismatches).iteritems():
+        names[dist].extend(get_names(sequence))
+    return [",".join(sorted(n)) for n in names]
+
+def annotate_lines(lines, mismatches, cache):
+    """Return the tuple (output, count) for the given input lines, where
+    output is the text for the records having an index sequence, with the
+    annotation added, and count the number of such records.
+    The annotations of recently seen index sequences are cached."""
+    result = []
+    for record in lines:
+        index = get_index(record)
         if index is None:
             continue
+        annotation = cache.get(index)
+        if annotation is None:
+            annotation = annotate(index, mismatches)
+            cache.set(index, annotation)
+        result.append("\t".join(record.strip().split() + annotation))
+    count = len(result)
+    if result:
+        result.append('')               # Final newline
+    return "\n".join(result), count
 
-        names = []
-        for name, sequence in BASIC_LOOKUP.items():
-            try:
-                dist = hamming_distance(index,sequence)
-                if dist <= mismatches:
-                    names.append([name,dist])
-            except:
-                pass
+def read_chunks(infile, chunk_size):
+    "Generate lists of at most 'chunk_size' lines from the input file."
+    chunk = []
+    for line in infile:
+        chunk.append(line)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def annotate_stream(infile, outfile, mismatches=1, cache_size=100000,
+                    chunk_size=10000):
+    """Read records from the input file, and write them to the output file
+    with the annotation added, for each record having an index sequence.
+    The input is processed, and the output written, in chunks of
+    'chunk_size' lines. Return a dictionary of statistics."""
+    cache = LRUCache(cache_size)
+    lines = 0
+    annotated = 0
+    for chunk in read_chunks(infile, chunk_size):
+        output, count = annotate_lines(chunk, mismatches, cache)
+        outfile.write(output)
+        lines += len(chunk)
+        annotated += count
+    outfile.flush()
+    return dict(lines=lines, annotated=annotated,
+                computed=cache.misses, cached=cache.hits)
+
+
+# The settings and cache of a worker process in annotate_parallel.
+_worker = dict()
+
+def _init_worker(mismatches, cache_size):
+    _worker['mismatches'] = mismatches
+    _worker['cache'] = LRUCache(cache_size)
+
+def _annotate_chunk(chunk):
+    cache = _worker['cache']
+    misses, hits = cache.misses, cache.hits
+    output, count = annotate_lines(chunk, _worker['mismatches'], cache)
+    return (output, len(chunk), count,
+            cache.misses - misses, cache.hits - hits)
+
+def annotate_parallel(infile, outfile, jobs, mismatches=1, cache_size=100000,
+                      chunk_size=10000):
+    """As annotate_stream, but with the chunks distributed over a pool of
+    'jobs' worker processes, each having its own cache. The output is
+    written in input order. The registry index is loaded before the
+    workers are started, so that they share it."""
+    import multiprocessing
+    registry_index = get_registry_index()
+    for length in get_lengths():
+        registry_index.get_bucket(length)
+    pool = multiprocessing.Pool(jobs, _init_worker, (mismatches, cache_size))
+    stats = dict(lines=0, annotated=0, computed=0, cached=0)
+    try:
+        for output, lines, annotated, computed, cached in \
+                pool.imap(_annotate_chunk, read_chunks(infile, chunk_size)):
+            outfile.write(output)
+            stats['lines'] += lines
+            stats['annotated'] += annotated
+            stats['computed'] += computed
+            stats['cached'] += cached
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    outfile.flush()
+    return stats
+
+if __name__ == '__main__':
+    import optparse
+    import time
 
-        print("\t".join(record.strip().split() + [",".join(sorted([n[0] for n in names if n[1] == i])) for i in range(mismatches+1)]))
+    parser = optparse.OptionParser(usage='%prog [options] < infile > outfile',
+                                   description=__doc__.strip())
+    parser.add_option('-k', '--mismatches', type='int', default=1,
+                      help='maximum number of mismatches (default 1)')
+    parser.add_option('--cache-size', type='int', default=100000,
+                      help='number of annotated sequences to cache'
+                      ' (default 100000)')
+    parser.add_option('-j', '--jobs', type='int', default=1,
+                      help='number of worker processes (default 1)')
+    parser.add_option('--chunk-size', type='int', default=10000,
+                      help='number of lines per chunk (default 10000)')
+    parser.add_option('-q', '--quiet', action='store_true', default=False,
+                      help='do not report throughput on standard error')
+    options, args = parser.parse_args()
 
+    start = time.time()
+    if options.jobs > 1:
+        stats = annotate_parallel(sys.stdin, sys.stdout, options.jobs,
+                                  mismatches=options.mismatches,
+                                  cache_size=options.cache_size,
+                                  chunk_size=options.chunk_size)
+    else:
+        stats = annotate_stream(sys.stdin, sys.stdout,
+                                mismatches=options.mismatches,
+                                cache_size=options.cache_size,
+                                chunk_size=options.chunk_size)
+    elapsed = max(time.time() - start, 1e-6)
+    if not options.quiet:
+        sys.stderr.write("%(lines)i lines, %(annotated)i annotated,"
+                         " %(computed)i computed, %(cached)i from cache; "
+                         % stats)
+        sys.stderr.write("%.1f s, %.0f lines/s\n"
+                         % (elapsed, stats['lines'] / elapsed))
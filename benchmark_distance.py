@@ -0,0 +1,53 @@
+"""Benchmark the Levenshtein distance implementations on a registry-sized
+workload: a number of observed barcodes, each compared with all index
+sequences of the registry.
+"""
+
+import optparse
+import random
+import time
+
+from samplesheet.index_registry import BASIC_LOOKUP
+from samplesheet.annotate_index import dp_levenshtein_distance, \
+    bitparallel_levenshtein_distance, levenshtein_distance
+
+
+def get_queries(sequences, count, mutations=2):
+    "Return the given number of randomly mutated registry sequences."
+    result = []
+    for i in xrange(count):
+        chars = list(random.choice(sequences))
+        for j in xrange(mutations):
+            chars[random.randrange(len(chars))] = random.choice('ACGT')
+        result.append(''.join(chars))
+    return result
+
+def run(function, queries, sequences):
+    "Return the tuple (seconds, total distance) for all pairs."
+    start = time.time()
+    total = 0
+    for query in queries:
+        for sequence in sequences:
+            total += function(query, sequence)
+    return time.time() - start, total
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--queries', type='int', default=20,
+                      help='number of query barcodes (default 20)')
+    options, args = parser.parse_args()
+    random.seed(0)
+    sequences = sorted(set(BASIC_LOOKUP.values()))
+    queries = get_queries(sequences, options.queries)
+    print("%i queries x %i registry sequences" % (len(queries),
+                                                  len(sequences)))
+    reference = None
+    for title, function in [('dynamic programming', dp_levenshtein_distance),
+                            ('bit-parallel', bitparallel_levenshtein_distance),
+                            ('levenshtein_distance', levenshtein_distance)]:
+        seconds, total = run(function, queries, sequences)
+        if reference is None:
+            reference = seconds
+        print("%-22s %7.3f s  %5.1fx  (checksum %i)"
+              % (title, seconds, reference / seconds, total))
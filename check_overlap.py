@@ -1,45 +1,199 @@
 """Check for overlap between index sequences.
 Output a CSV file listing all indexes, giving identical,
-one and two mismatch indexes.
+one and two mismatch indexes; optionally up to more mismatches.
+
+The sequences are compared up to the length of the shortest of them.
+The mismatch counts for all pairs are computed by NumPy, for blocks of
+sequences grouped by length and single/dual layout.
+
+The mismatch counts are computed kit against kit, and the blocks are kept
+in a cache file along with a fingerprint of each kit. When run again, only
+the blocks involving a kit that has been added or changed are recomputed.
 """
 
 import csv
+import hashlib
+import marshal
+import optparse
+import sys
+
+import numpy
+
+from samplesheet.index_registry import BASIC_LOOKUP, REGISTRY, NAME_RX, \
+    write_atomically
+
+TITLES = ['Identical', 'One mismatch', 'Two mismatches']
 
-from samplesheet.index_definitions import BASIC_LOOKUP
+CACHE_FILE = 'index_overlaps.dat'
+CACHE_VERSION = 1
 
-outfile = csv.writer(open('index_overlaps.csv', 'wb'))
-outfile.writerow(['Index', 'Sequence', 'Identical',
-                  'One mismatch', 'Two mismatches'])
 
 def compare(key1, key2):
-    for pos in xrange(len(key1)-1, -1, -1):
-        if not key1[pos].isdigit():
-            k1 = (key1[0:pos+1], int(key1[pos+1:]))
-            break
-    for pos in xrange(len(key2)-1, -1, -1):
-        if not key2[pos].isdigit():
-            k2 = (key2[0:pos+1], int(key2[pos+1:]))
-            break
-    return cmp(k1, k2)
-
-keys = sorted(BASIC_LOOKUP.keys(), cmp=compare)
-
-for key1 in keys:
-    seq1 = BASIC_LOOKUP[key1]
-    identical = []
-    one = []
-    two = []
-    for key2 in keys:
-        if key1 == key2: continue
-        seq2 = BASIC_LOOKUP[key2]
-        mismatch = 0
-        for n1, n2 in zip(seq1, seq2):
-            if n1 != n2: mismatch += 1
-        if mismatch == 0:
-            identical.append(key2)
-        elif mismatch == 1:
-            one.append(key2)
-        elif mismatch == 2:
-            two.append(key2)
-    outfile.writerow([key1, seq1, ' '.join(identical),
-                      ' '.join(one), ' '.join(two)])
+    "Compare index names by prefix, number and suffix, e.g. 'index1dual'."
+    k1 = NAME_RX.match(key1).groups()
+    k2 = NAME_RX.match(key2).groups()
+    return cmp((k1[0], int(k1[1]), k1[2]), (k2[0], int(k2[1]), k2[2]))
+
+def get_titles(max_mismatches):
+    "Return the column titles for 0 up to the given number of mismatches."
+    titles = TITLES[:max_mismatches+1]
+    for mismatches in xrange(len(titles), max_mismatches+1):
+        titles.append("%i mismatches" % mismatches)
+    return titles
+
+def get_groups(sequences):
+    """Return the positions of the sequences grouped by layout.
+    Key: (length, dual), value: list of positions."""
+    result = dict()
+    for pos, sequence in enumerate(sequences):
+        result.setdefault((len(sequence), '-' in sequence), []).append(pos)
+    return result
+
+def encode(sequences, length):
+    "Return the uint8 array of the sequences truncated to the length."
+    data = ''.join([s[:length] for s in sequences])
+    return numpy.frombuffer(data, dtype=numpy.uint8).reshape(len(sequences),
+                                                             length)
+
+def get_mismatch_matrix(sequences1, sequences2):
+    """Return the matrix of the number of mismatches between all pairs of
+    sequences from the two lists, compared up to the shortest of them."""
+    result = numpy.zeros((len(sequences1), len(sequences2)), dtype=numpy.int32)
+    groups2 = get_groups(sequences2).items()
+    for (length1, dual1), positions1 in get_groups(sequences1).iteritems():
+        seqs1 = [sequences1[pos] for pos in positions1]
+        for (length2, dual2), positions2 in groups2:
+            length = min(length1, length2)
+            block1 = encode(seqs1, length)
+            block2 = encode([sequences2[pos] for pos in positions2], length)
+            block = (block1[:, None, :] != block2[None, :, :]).sum(axis=2)
+            result[numpy.ix_(positions1, positions2)] = block
+    return result
+
+def get_overlaps(lookup=BASIC_LOOKUP):
+    """Return the tuple (keys, matrix) of the sorted index names of the
+    lookup and the matrix of mismatches between all their sequences."""
+    keys = sorted(lookup.keys(), cmp=compare)
+    return keys, get_mismatch_matrix([lookup[key] for key in keys],
+                                     [lookup[key] for key in keys])
+
+def get_fingerprint(kit):
+    "Return the MD5 digest of the index names and sequences of the kit."
+    return hashlib.md5(repr(sorted(kit.items()))).hexdigest()
+
+def read_cache(filepath):
+    """Return the tuple (fingerprints, blocks) from the cache file,
+    or empty dictionaries if it is missing, invalid or of another version."""
+    try:
+        infile = open(filepath, 'rb')
+        try:
+            version, fingerprints, blocks = marshal.load(infile)
+        finally:
+            infile.close()
+    except (IOError, EOFError, ValueError, TypeError):
+        return dict(), dict()
+    if version != CACHE_VERSION:
+        return dict(), dict()
+    return fingerprints, blocks
+
+def write_cache(filepath, fingerprints, blocks):
+    "Write the fingerprints and blocks to the cache file."
+    write_atomically(filepath,
+                     marshal.dumps((CACHE_VERSION, fingerprints, blocks)))
+
+def get_kit_overlaps(registry=REGISTRY, cachefile=CACHE_FILE):
+    """Return the tuple (keys, matrix, recomputed) of the sorted index names
+    of all kits in the registry, the matrix of mismatches between all their
+    sequences, and the number of kit blocks that had to be computed.
+    The blocks are taken from the cache file, if given, when the fingerprints
+    of both kits are unchanged, and the cache file is updated if needed.
+    Key of a block: (kitname1, kitname2), in registry order, value:
+    the matrix of mismatches as a uint8 string."""
+    kitnames = registry.get_kitnames()
+    keys = dict()                       # Key: kitname, value: sorted names
+    fingerprints = dict()
+    for kitname in kitnames:
+        kit = registry.get_kit(kitname)
+        keys[kitname] = sorted(kit.keys(), cmp=compare)
+        fingerprints[kitname] = get_fingerprint(kit)
+    if cachefile:
+        cached_fingerprints, cached_blocks = read_cache(cachefile)
+    else:
+        cached_fingerprints, cached_blocks = dict(), dict()
+    blocks = dict()
+    recomputed = 0
+    for pos1, kitname1 in enumerate(kitnames):
+        for kitname2 in kitnames[pos1:]:
+            key = (kitname1, kitname2)
+            if cached_fingerprints.get(kitname1) == fingerprints[kitname1] and \
+               cached_fingerprints.get(kitname2) == fingerprints[kitname2] and \
+               key in cached_blocks:
+                blocks[key] = cached_blocks[key]
+            else:
+                kit1 = registry.get_kit(kitname1)
+                kit2 = registry.get_kit(kitname2)
+                block = get_mismatch_matrix(
+                    [kit1[name] for name in keys[kitname1]],
+                    [kit2[name] for name in keys[kitname2]])
+                blocks[key] = block.astype(numpy.uint8).tostring()
+                recomputed += 1
+    if cachefile and (recomputed or len(blocks) != len(cached_blocks)):
+        write_cache(cachefile, fingerprints, blocks)
+    # Assemble the full matrix from the blocks, in registry order.
+    starts = dict()
+    total = 0
+    for kitname in kitnames:
+        starts[kitname] = total
+        total += len(keys[kitname])
+    matrix = numpy.zeros((total, total), dtype=numpy.int32)
+    for (kitname1, kitname2), data in blocks.iteritems():
+        rows = slice(starts[kitname1], starts[kitname1] + len(keys[kitname1]))
+        cols = slice(starts[kitname2], starts[kitname2] + len(keys[kitname2]))
+        block = numpy.frombuffer(data, dtype=numpy.uint8).reshape(
+            len(keys[kitname1]), len(keys[kitname2]))
+        matrix[rows, cols] = block
+        matrix[cols, rows] = block.T
+    # Reorder the rows and columns by index name.
+    allkeys = []
+    for kitname in kitnames:
+        allkeys.extend(keys[kitname])
+    order = sorted(xrange(total), cmp=compare, key=allkeys.__getitem__)
+    return [allkeys[pos] for pos in order], matrix[numpy.ix_(order, order)], \
+        recomputed
+
+def write_overlaps(outfile, keys, sequences, matrix, max_mismatches=2):
+    """Write the CSV file of the overlaps between the index sequences,
+    given the index names, their sequences and the matrix of mismatches."""
+    writer = csv.writer(outfile)
+    writer.writerow(['Index', 'Sequence'] + get_titles(max_mismatches))
+    matrix = matrix.copy()
+    numpy.fill_diagonal(matrix, max_mismatches + 1)
+    for pos, key in enumerate(keys):
+        row = matrix[pos]
+        found = [[] for mismatches in xrange(max_mismatches+1)]
+        for other in numpy.flatnonzero(row <= max_mismatches):
+            found[row[other]].append(keys[other])
+        writer.writerow([key, sequences[pos]] + [' '.join(f) for f in found])
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('-k', '--mismatches', type='int', default=2,
+                      help='maximum number of mismatches to list (default 2)')
+    parser.add_option('-o', '--output', default='index_overlaps.csv',
+                      help='output CSV file (default index_overlaps.csv)')
+    parser.add_option('-c', '--cache', default=CACHE_FILE,
+                      help="cache file of the kit blocks (default %s)"
+                      % CACHE_FILE)
+    parser.add_option('--no-cache', action='store_true', default=False,
+                      help='compute all pairs, without using the cache file')
+    options, args = parser.parse_args()
+    if options.no_cache:
+        keys, matrix = get_overlaps()
+    else:
+        keys, matrix, recomputed = get_kit_overlaps(cachefile=options.cache)
+        sys.stderr.write("%i kit blocks recomputed\n" % recomputed)
+    outfile = open(options.output, 'wb')
+    write_overlaps(outfile, keys, [BASIC_LOOKUP[key] for key in keys],
+                   matrix, max_mismatches=options.mismatches)
+    outfile.close()
@@ -0,0 +1,71 @@
+"""Check the colour balance of the index reads of a lane.
+
+At every cycle of an index read, the instrument must see signal in each
+of its channels, or it cannot register the clusters. With two-colour
+chemistry (NextSeq, NovaSeq) A gives signal in both channels, C only in
+the red and T only in the green, while G is dark. With four-colour
+chemistry (HiSeq, MiSeq) the red laser reads A and C, the green G and T.
+
+The base composition is computed for all index sequences in a lane at
+once, by transposing them into one string of bases per cycle.
+"""
+
+import itertools
+
+from dual_index import split_reads
+
+# Bases giving signal in each channel, by chemistry.
+TWO_COLOUR_CHANNELS = (('red', 'AC'), ('green', 'AT'))
+FOUR_COLOUR_CHANNELS = (('red', 'AC'), ('green', 'GT'))
+
+BASES = 'ACGTN'
+
+
+def get_cycles(sequences):
+    """Return the list of the index reads, each a list of strings giving
+    the bases of all sequences at each cycle. A sequence shorter than
+    others does not contribute to the later cycles."""
+    reads = itertools.izip_longest(*[split_reads(s) for s in sequences],
+                                   fillvalue='')
+    return [[''.join(bases) for bases
+             in itertools.izip_longest(*read, fillvalue='')]
+            for read in reads]
+
+def get_composition(sequences):
+    """Return the list of the index reads, each a list of dictionaries
+    giving the number of each base at each cycle."""
+    return [[dict([(base, bases.count(base)) for base in BASES])
+             for bases in read]
+            for read in get_cycles(sequences)]
+
+def get_dark_cycles(sequences, channels=TWO_COLOUR_CHANNELS):
+    """Return the list of tuples (read number, cycle number, channel name)
+    for the cycles of the index reads where no sequence gives signal in
+    the channel. Read and cycle numbers are 1-based."""
+    result = []
+    for number, read in enumerate(get_cycles(sequences)):
+        for cycle, bases in enumerate(read):
+            for name, signal in channels:
+                if not [base for base in signal if base in bases]:
+                    result.append((number + 1, cycle + 1, name))
+    return result
+
+def get_colour_balance_warning(sequences, channels=TWO_COLOUR_CHANNELS):
+    """Return a warning if any cycle of the index reads lacks signal in
+    a channel, else None. A single sequence is not checked, since it
+    need not be demultiplexed."""
+    if len(set(sequences)) < 2: return None
+    dark = get_dark_cycles(sequences, channels=channels)
+    if not dark: return None
+    dual = max([len(split_reads(s)) for s in sequences]) > 1
+    cycles = dict()                 # Key: channel name, value: cycle specs
+    for number, cycle, name in dark:
+        if dual:
+            spec = "%i:%i" % (number, cycle)
+        else:
+            spec = str(cycle)
+        cycles.setdefault(name, []).append(spec)
+    return ('Poor colour balance; no signal in the %s.' %
+            '; '.join(["%s channel at index cycle %s" % (name,
+                                                          ', '.join(specs))
+                       for name, specs in sorted(cycles.items())]))
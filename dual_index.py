@@ -0,0 +1,156 @@
+"""Distances between dual index sequences, computed per read.
+
+Dual index sequences are stored as 'i7-i5'. The demultiplexer matches
+each index read separately, so two dual indexes can be told apart only
+if at least one of their reads is sufficiently different. The distances
+are therefore computed per read, rather than over the joined string.
+
+The reads are split once when a sequence is added. Hamming distances
+for reads of equal length are computed in batch from the packed 2-bit
+encoding; reads of unequal length are compared up to the shortest.
+Other pairwise distances are memoized in the shared distance cache.
+"""
+
+from annotate_index import cached_distance, within
+from index_packing import PackedSequences
+
+SEPARATOR = '-'
+
+
+def split_reads(sequence):
+    "Return the tuple of the index reads of the sequence."
+    return tuple(sequence.split(SEPARATOR))
+
+def is_dual(sequence):
+    "Is the sequence a dual index?"
+    return SEPARATOR in sequence
+
+
+class DualIndexes(object):
+    "A set of dual index sequences, for distances per read in batch."
+
+    def __init__(self, sequences=[]):
+        self.sequences = []
+        self.reads = []                 # Tuple of reads per sequence
+        # Key: (read number, read length), value: (positions, packed reads)
+        self.packed = dict()
+        for sequence in sequences:
+            self.add(sequence)
+
+    def __len__(self):
+        return len(self.sequences)
+
+    def __contains__(self, sequence):
+        return sequence in self.sequences
+
+    def add(self, sequence):
+        "Add the dual index sequence."
+        reads = split_reads(sequence)
+        position = len(self.sequences)
+        self.sequences.append(sequence)
+        self.reads.append(reads)
+        for number, read in enumerate(reads):
+            key = (number, len(read))
+            try:
+                positions, packed = self.packed[key]
+            except KeyError:
+                positions, packed = self.packed[key] = \
+                    ([], PackedSequences(len(read)))
+            try:
+                packed.add(read)
+            except ValueError:          # Cannot be packed
+                continue
+            positions.append(position)
+
+    def hamming_distances(self, sequence):
+        """Return the list of tuples (sequence, distances) for all sequences
+        in the set, where distances is the tuple of the Hamming distances
+        per read, compared up to the shortest read. A read missing in
+        either sequence has distance None."""
+        reads = split_reads(sequence)
+        distances = [[None] * max(len(reads), len(r)) for r in self.reads]
+        for number, read in enumerate(reads):
+            done = set()
+            try:
+                positions, packed = self.packed[(number, len(read))]
+                found = packed.distances(read)
+            except (KeyError, ValueError):
+                pass
+            else:
+                for position, (other, distance) in zip(positions, found):
+                    distances[position][number] = distance
+                    done.add(position)
+            for position, other_reads in enumerate(self.reads):
+                if position in done or number >= len(other_reads): continue
+                distances[position][number] = \
+                    cached_distance(read, other_reads[number], shortest=True)
+        return [(s, tuple(d)) for s, d in zip(self.sequences, distances)]
+
+    def levenshtein_distances(self, sequence):
+        """Return the list of tuples (sequence, distances) for all sequences
+        in the set, where distances is the tuple of the Levenshtein
+        distances per read, compared up to the shortest read. A read
+        missing in either sequence has distance None."""
+        reads = split_reads(sequence)
+        result = []
+        for other, other_reads in zip(self.sequences, self.reads):
+            distances = []
+            for number in xrange(max(len(reads), len(other_reads))):
+                try:
+                    distances.append(cached_distance(reads[number],
+                                                     other_reads[number],
+                                                     'levenshtein',
+                                                     shortest=True))
+                except IndexError:
+                    distances.append(None)
+            result.append((other, tuple(distances)))
+        return result
+
+    def levenshtein_close(self, sequence, max_distance):
+        """Return the set of sequences in the set for which every read is
+        within the given Levenshtein distance of the corresponding read
+        of the sequence, compared up to the shortest read. A read missing
+        in either sequence does not separate them."""
+        reads = split_reads(sequence)
+        result = set()
+        for other, other_reads in zip(self.sequences, self.reads):
+            for read, other_read in zip(reads, other_reads):
+                if not within(read, other_read, max_distance, shortest=True):
+                    break
+            else:
+                result.add(other)
+        return result
+
+    def minimum_distances(self, metric='hamming'):
+        """Return a dictionary with key sequence and value the tuple of the
+        minimum distance per read to any other sequence in the set.
+        The metric is either 'hamming' or 'levenshtein'."""
+        if metric == 'hamming':
+            get_distances = self.hamming_distances
+        elif metric == 'levenshtein':
+            get_distances = self.levenshtein_distances
+        else:
+            raise ValueError("unknown metric %s" % metric)
+        result = dict()
+        for sequence in self.sequences:
+            minimum = None
+            for other, distances in get_distances(sequence):
+                if other == sequence: continue
+                if minimum is None:
+                    minimum = list(distances)
+                else:
+                    for number, distance in enumerate(distances):
+                        if number >= len(minimum):
+                            minimum.append(distance)
+                        elif minimum[number] is None or \
+                           (distance is not None and distance < minimum[number]):
+                            minimum[number] = distance
+            result[sequence] = minimum and tuple(minimum)
+        return result
+
+
+def is_too_close(distances, minimum):
+    """Are the per-read distances all less than the minimum, i.e. can the
+    demultiplexer not tell the two dual indexes apart by any read?
+    A read missing in either sequence does not separate them."""
+    return all([d is None or d < minimum for d in distances])
@@ -0,0 +1,137 @@
+"""Report the most frequent index sequences in FASTQ files, e.g. the
+undetermined reads of a run, annotated with the names of the matching
+and close-matching indexes.
+
+The FASTQ files, optionally gzipped, are streamed, and the index is
+taken from the header of each read, e.g. '@...:1101:1234:5678 1:N:0:ATCACG'
+or the older '@...#ATCACG/1'. Dual indexes 'i7+i5' are given as 'i7-i5',
+as in the index definitions.
+
+The counts are kept in a fixed-memory Space-Saving summary, so the
+memory use does not depend on the number of distinct sequences. Each
+reported count may be overestimated by at most the given error.
+"""
+
+import gzip
+import heapq
+import io
+import itertools
+import sys
+
+from annotate_index import annotate
+
+
+def get_header_index(header):
+    "Return the index sequence in the FASTQ header line, or None."
+    header = header.rstrip()
+    parts = header.split()
+    if len(parts) >= 2:                 # CASAVA 1.8 and later
+        index = parts[1].split(':')[-1]
+    elif '#' in header:                 # Older CASAVA
+        index = header.split('#')[-1].split('/')[0]
+    else:
+        return None
+    index = index.upper().replace('+', '-')
+    if not index or index.strip('ACGTN-'):
+        return None
+    return index
+
+def open_fastq(filepath):
+    "Return an open file for the FASTQ file; gzipped if '.gz', '-' for stdin."
+    if filepath == '-':
+        return sys.stdin
+    if filepath.endswith('.gz'):
+        return io.BufferedReader(gzip.open(filepath, 'rb'))
+    return open(filepath, 'rb')
+
+def read_indexes(infile):
+    "Generate the index sequences from the headers of the FASTQ records."
+    for header in itertools.islice(infile, 0, None, 4):
+        index = get_header_index(header)
+        if index is not None:
+            yield index
+
+
+class SpaceSaving(object):
+    """Heavy-hitter summary of a stream, monitoring at most 'capacity'
+    items (Metwally et al. 2005). An item not monitored replaces the one
+    with the smallest count, inheriting that count as its error."""
+
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError('capacity must be at least 1')
+        self.capacity = capacity
+        self.total = 0
+        self.counts = dict()            # Key: item, value: count
+        self.errors = dict()            # Key: item, value: overestimation
+        # Heap of (count, item) for each monitored item; the count may be
+        # outdated, but is never larger than the current count.
+        self.heap = []
+
+    def add(self, item, count=1):
+        "Add the item to the summary."
+        self.total += count
+        try:
+            self.counts[item] += count
+        except KeyError:
+            if len(self.counts) < self.capacity:
+                self.counts[item] = count
+                self.errors[item] = 0
+                heapq.heappush(self.heap, (count, item))
+            else:
+                while True:
+                    smallest, evicted = heapq.heappop(self.heap)
+                    current = self.counts[evicted]
+                    if current == smallest: break
+                    heapq.heappush(self.heap, (current, evicted))
+                del self.counts[evicted]
+                del self.errors[evicted]
+                self.counts[item] = smallest + count
+                self.errors[item] = smallest
+                heapq.heappush(self.heap, (smallest + count, item))
+
+    def top(self, number):
+        """Return the list of tuples (item, count, error) for the items with
+        the highest counts, at most the given number of them."""
+        items = sorted(self.counts.iteritems(), key=lambda i: (-i[1], i[0]))
+        return [(item, count, self.errors[item])
+                for item, count in items[:number]]
+
+
+def write_report(summary, outfile, top=20, mismatches=1):
+    "Write the tab-separated report of the top index sequences."
+    columns = ['Index', 'Count', 'Error', 'Identical']
+    columns.extend(["%i mismatch" % i for i in xrange(1, mismatches+1)])
+    outfile.write("\t".join(columns) + "\n")
+    for index, count, error in summary.top(top):
+        row = [index, str(count), str(error)] + annotate(index, mismatches)
+        outfile.write("\t".join(row) + "\n")
+
+
+if __name__ == '__main__':
+    import optparse
+
+    parser = optparse.OptionParser(usage='%prog [options] file.fastq[.gz]...',
+                                   description=__doc__.split('\n\n')[0])
+    parser.add_option('-n', '--top', type='int', default=20,
+                      help='number of index sequences to report (default 20)')
+    parser.add_option('-k', '--mismatches', type='int', default=1,
+                      help='maximum number of mismatches (default 1)')
+    parser.add_option('-c', '--capacity', type='int', default=10000,
+                      help='number of index sequences to keep counts for'
+                      ' (default 10000)')
+    options, filepaths = parser.parse_args()
+    if not filepaths:
+        parser.error('no FASTQ files given')
+
+    summary = SpaceSaving(max(options.capacity, options.top))
+    for filepath in filepaths:
+        infile = open_fastq(filepath)
+        before = summary.total
+        for index in read_indexes(infile):
+            summary.add(index)
+        if infile is not sys.stdin:
+            infile.close()
+        sys.stderr.write("%s: %i reads\n" % (filepath, summary.total - before))
+    write_report(summary, sys.stdout,
+                 top=options.top, mismatches=options.mismatches)
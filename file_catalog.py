@@ -0,0 +1,234 @@
+"""In-process catalog of the samplesheet files in the yearly directories.
+
+Each yearly directory is listed once, and the path and modification time
+of each of its files are kept. A directory is listed again only when its
+own modification time has changed, which happens whenever a file is
+created, renamed or deleted in it.
+
+Looking up a flowcell checks only the directory of the current year,
+where new files are created, and the directory of the flowcell's file.
+All directories are checked at most every CHECK_INTERVAL seconds, to
+pick up changes made outside of the application. Listing all files
+checks every directory, but lists only those that have been modified.
+
+A directory modified within RACY_INTERVAL seconds of being listed may be
+modified again within the resolution of its timestamp, so such a listing
+is not trusted, and the directory is listed again on the next check.
+
+The catalog may be shared by threads; its entries are read and modified
+only while holding its lock.
+"""
+
+import hashlib
+import os
+import threading
+import time
+
+# Seconds between checks of all the yearly directories.
+CHECK_INTERVAL = 10.0
+
+# Seconds within which a change of a directory may go unnoticed.
+RACY_INTERVAL = 2.0
+
+FILE_EXTENSION = '.csv'
+
+# Signature of a directory listing which must not be trusted.
+RACY = object()
+
+
+class Catalog(object):
+    "Catalog of the files in the yearly subdirectories of a directory."
+
+    def __init__(self, dirpath, first_year):
+        self.dirpath = os.path.normpath(dirpath)
+        self.first_year = first_year
+        # Key: year, value: tuple (signature, entries), where the signature
+        # is the directory modification time, None if it does not exist,
+        # or RACY. Entries is a dict with key: fcid, value: tuple
+        # (filepath, modification time).
+        self.directories = dict()
+        self.checked = None
+        # Incremented whenever any entries may have changed.
+        self.version = 0
+        # Tuple (version, digest, last modified) computed by get_state.
+        self.state = None
+        # Times of the directory itself when last listed successfully.
+        self.signature = None
+        # Re-entrant, since the methods call each other.
+        self.lock = threading.RLock()
+
+    def get_years(self):
+        "Return the list of years, from the first to the current one."
+        return range(self.first_year, time.localtime()[0] + 1)
+
+    def get_dirpath(self, year):
+        "Return the path of the directory for the year."
+        return os.path.join(self.dirpath, str(year))
+
+    def refresh(self, year):
+        """Return the entries of the directory for the year, listing it
+        again if it has been modified since it was last listed.
+        The entries must be used only while holding the lock."""
+        with self.lock:
+            dirpath = self.get_dirpath(year)
+            try:
+                signature = os.stat(dirpath).st_mtime
+            except OSError:
+                signature = None
+            try:
+                previous, entries = self.directories[year]
+                if previous is not RACY and previous == signature:
+                    return entries
+            except KeyError:
+                pass
+            entries = dict()
+            if signature is not None:
+                if time.time() - signature < RACY_INTERVAL:
+                    signature = RACY
+                try:
+                    filenames = os.listdir(dirpath)
+                except OSError:
+                    filenames = []
+                for filename in filenames:
+                    fcid, extension = os.path.splitext(filename)
+                    if extension != FILE_EXTENSION: continue
+                    filepath = os.path.join(dirpath, filename)
+                    try:
+                        entries[fcid] = (filepath, os.path.getmtime(filepath))
+                    except OSError:     # Removed since listed
+                        pass
+            self.directories[year] = (signature, entries)
+            self.version += 1
+            return entries
+
+    def refresh_all(self, force=False):
+        """Check all directories, unless done within CHECK_INTERVAL seconds
+        and not forced. Return True if they were checked."""
+        with self.lock:
+            now = time.time()
+            if not force and self.checked is not None and \
+               now - self.checked < CHECK_INTERVAL:
+                return False
+            for year in self.get_years():
+                self.refresh(year)
+            self.checked = now
+            return True
+
+    def lookup(self, fcid):
+        """Return the tuple (filepath, modification time) of the file for
+        the flowcell, or None if there is none. The earliest year wins."""
+        with self.lock:
+            if not self.refresh_all():
+                self.refresh(self.get_years()[-1])
+            for year in self.get_years():
+                try:
+                    signature, entries = self.directories[year]
+                except KeyError:
+                    entries = self.refresh(year)
+                if fcid not in entries: continue
+                # Make sure the file is still there.
+                entry = self.refresh(year).get(fcid)
+                if entry: return entry
+            return None
+
+    def get_entries(self, year=None):
+        """Return the list of tuples (fcid, filepath, modification time) for
+        all files, or those of the given year, after checking all
+        directories. Only the directories modified since last listed are
+        listed again. If a flowcell has files in several years, the
+        earliest year wins."""
+        with self.lock:
+            self.refresh_all(force=True)
+            result = []
+            seen = set()
+            for found in self.get_years():
+                entries = self.directories[found][1]
+                if year is not None and found != year:
+                    seen.update(entries)
+                    continue
+                for fcid, (filepath, mtime) in entries.iteritems():
+                    if fcid in seen: continue
+                    seen.add(fcid)
+                    result.append((fcid, filepath, mtime))
+            return result
+
+    def get_listing(self):
+        """Return the tuple (entries, digest, last modified) for all files,
+        where the entries are as given by get_entries, and the digest and
+        last modified time as by get_state, from a single check of all
+        directories."""
+        with self.lock:
+            entries = self.get_entries()
+            if self.state is None or self.state[0] != self.version:
+                digest = hashlib.md5(repr(sorted(entries))).hexdigest()
+                times = [e[2] for e in entries]
+                times.extend([signature for signature, e
+                              in self.directories.itervalues()
+                              if isinstance(signature, float)])
+                self.state = (self.version, digest, max(times or [0]))
+            return (entries,) + self.state[1:]
+
+    def get_state(self):
+        """Return the tuple (digest, last modified) for all files, after
+        checking all directories. The digest is computed from the names
+        and modification times of the files, so it is the same in all
+        processes. The last modified time is the latest of the files and
+        the directories, so that a removal also counts."""
+        return self.get_listing()[1:]
+
+    def is_readable(self):
+        """Can the directory be listed? It is listed again only if its
+        modification or status change time has changed."""
+        with self.lock:
+            try:
+                info = os.stat(self.dirpath)
+                signature = (info.st_mtime, info.st_ctime)
+                if self.signature is RACY or signature != self.signature:
+                    os.listdir(self.dirpath)
+                    if time.time() - info.st_ctime < RACY_INTERVAL:
+                        signature = RACY
+                    self.signature = signature
+            except OSError:
+                self.signature = None
+                return False
+            return True
+
+    def get_filepath(self, fcid):
+        """Return the path of the file for the flowcell. If there is none,
+        return the path in the directory of the current year."""
+        try:
+            return self.lookup(fcid)[0]
+        except TypeError:
+            return os.path.join(self.get_dirpath(self.get_years()[-1]),
+                                fcid + FILE_EXTENSION)
+
+    def update(self, filepath):
+        "Record the file, which has been created or written."
+        with self.lock:
+            year = self.get_year(filepath)
+            if year is None: return
+            fcid = os.path.splitext(os.path.basename(filepath))[0]
+            entries = self.refresh(year)
+            try:
+                entries[fcid] = (filepath, os.path.getmtime(filepath))
+            except OSError:
+                entries.pop(fcid, None)
+            self.version += 1
+
+    def discard(self, filepath):
+        "Forget the file, which has been removed or moved elsewhere."
+        with self.lock:
+            year = self.get_year(filepath)
+            if year is None: return
+            fcid = os.path.splitext(os.path.basename(filepath))[0]
+            self.refresh(year).pop(fcid, None)
+            self.version += 1
+
+    def get_year(self, filepath):
+        "Return the year of the directory of the file, or None if none."
+        dirpath = os.path.dirname(os.path.normpath(filepath))
+        if os.path.dirname(dirpath) != self.dirpath: return None
+        try:
+            return int(os.path.basename(dirpath))
+        except ValueError:
+            return None
@@ -0,0 +1,233 @@
+"""Assign index sequences from given kits to the samples of a lane.
+
+The indexes are chosen to maximize the minimum pairwise Hamming distance
+within the lane, given the index sequences already in it, subject to the
+minimum Hamming and Levenshtein distances. The distances are those of the
+lane check: per read for dual indexes, where a single sufficiently
+different read separates them, else as strings up to the shortest.
+
+For a given minimum distance, the compatible candidates form a graph, and
+an assignment is a clique of the required size in it. The cliques are
+searched for by backtracking over bitsets, i.e. integers with one bit per
+candidate, pruning whenever too few compatible candidates remain, or
+when a greedy colouring shows that no large enough clique can remain. The
+largest feasible minimum distance is found by bisection.
+"""
+
+from index_registry import REGISTRY, NAME_RX
+from index_packing import PackedSequences, popcount
+from dual_index import DualIndexes, is_dual, split_reads
+from annotate_index import cached_distance
+
+# Maximum number of search nodes for each minimum distance tried.
+MAX_NODES = 20000
+
+
+def get_name_key(name):
+    "Return the key for sorting index names by prefix, number and suffix."
+    match = NAME_RX.match(name)
+    return match.group(1), int(match.group(2)), match.group(3)
+
+def get_candidates(kitnames, registry=REGISTRY):
+    """Return the list of tuples (name, sequence) of the indexes in the kits,
+    in the given kit order, skipping sequences already seen.
+    Raise ValueError if no such kit."""
+    result = []
+    seen = set()
+    for kitname in kitnames:
+        try:
+            kit = registry.get_kit(kitname)
+        except KeyError:
+            raise ValueError("no such kit %s" % kitname)
+        for name in sorted(kit, key=get_name_key):
+            if kit[name] in seen: continue
+            seen.add(kit[name])
+            result.append((name, kit[name]))
+    return result
+
+def get_separations(sequences):
+    """Return the matrix (list of lists) of the Hamming distances between
+    all sequences, as in the lane check: for dual indexes the largest of
+    the distances per read, else the distance up to the shortest."""
+    count = len(sequences)
+    result = [[0] * count for pos in xrange(count)]
+    groups = dict()             # Key: None for duals, else length of single
+    for pos, sequence in enumerate(sequences):
+        key = not is_dual(sequence) and len(sequence) or None
+        groups.setdefault(key, []).append(pos)
+    for key, positions in groups.iteritems():
+        if key is None:
+            duals = DualIndexes([sequences[pos] for pos in positions])
+            for pos in positions:
+                found = duals.hamming_distances(sequences[pos])
+                for other, (s, distances) in zip(positions, found):
+                    result[pos][other] = max([d for d in distances
+                                              if d is not None] or [0])
+            continue
+        try:
+            packed = PackedSequences(key, [sequences[pos] for pos in positions])
+        except ValueError:              # Cannot be packed
+            packed = None
+        for pos in positions:
+            if packed is None:
+                distances = [cached_distance(sequences[pos], sequences[other])
+                             for other in positions]
+            else:
+                distances = [d for s, d in packed.distances(sequences[pos])]
+            for other, distance in zip(positions, distances):
+                result[pos][other] = distance
+    # Sequences of different layouts are compared as strings.
+    keys = groups.items()
+    for pos1, (key1, positions1) in enumerate(keys):
+        for key2, positions2 in keys[pos1+1:]:
+            for pos in positions1:
+                for other in positions2:
+                    result[pos][other] = result[other][pos] = \
+                        cached_distance(sequences[pos], sequences[other],
+                                        shortest=True)
+    return result
+
+def is_levenshtein_separated(s1, s2, minimum):
+    """Are the two sequences at least the minimum Levenshtein distance
+    apart, as in the lane check?"""
+    if is_dual(s1) and is_dual(s2):
+        pairs = zip(split_reads(s1), split_reads(s2))
+    else:
+        pairs = [(s1, s2)]
+    for read1, read2 in pairs:
+        if cached_distance(read1, read2, 'levenshtein',
+                           shortest=True) >= minimum:
+            return True
+    return False
+
+def count_colours(compatible, vertices):
+    """Return the number of colours in a greedy colouring of the vertices
+    in the bitset, such that no compatible vertices share a colour. This
+    is an upper bound of the size of any clique among them."""
+    result = 0
+    while vertices:
+        result += 1
+        uncoloured = vertices
+        while uncoloured:
+            lowest = uncoloured & -uncoloured
+            vertices ^= lowest
+            uncoloured &= ~(compatible[lowest.bit_length() - 1] | lowest)
+    return result
+
+def find_clique(compatible, size, max_nodes=MAX_NODES):
+    """Return the list of positions of 'size' pairwise compatible vertices,
+    or None if there is none, or if not found within 'max_nodes' nodes.
+    'compatible' is the list of the bitsets of the vertices compatible
+    with each vertex. Lower positions are tried first."""
+    nodes = [0]
+
+    def search(chosen, remaining):
+        if len(chosen) == size:
+            return chosen
+        nodes[0] += 1
+        if nodes[0] > max_nodes: return None
+        while popcount(remaining) >= size - len(chosen):
+            if count_colours(compatible, remaining) < size - len(chosen):
+                return None
+            lowest = remaining & -remaining
+            vertex = lowest.bit_length() - 1
+            result = search(chosen + [vertex], remaining & compatible[vertex])
+            if result is not None or nodes[0] > max_nodes:
+                return result
+            remaining ^= lowest
+        return None
+
+    return search([], (1 << len(compatible)) - 1)
+
+def _solve(count, candidates, fixed, min_hamming, min_levenshtein, max_nodes):
+    """Return the tuple (positions of the chosen candidates, minimum distance)
+    for the largest feasible minimum distance, or None if none is."""
+    sequences = list(fixed) + [c[1] for c in candidates]
+    offset = len(fixed)
+    separations = get_separations(sequences)
+    # For equal lengths a Levenshtein distance below 2 implies a Hamming
+    # distance below 2, so only a larger minimum needs to be checked.
+    if min_levenshtein > min(2, min_hamming):
+        separated = [[is_levenshtein_separated(s1, s2, min_levenshtein)
+                      for s2 in sequences] for s1 in sequences]
+    else:
+        separated = None
+
+    def get_compatible(pos, others, distance):
+        row = separations[pos]
+        result = [other for other in others if row[other] >= distance]
+        if separated is not None:
+            result = [other for other in result if separated[pos][other]]
+        return result
+
+    def solve(distance):
+        fixed_positions = range(offset)
+        usable = [pos for pos in xrange(offset, len(sequences))
+                  if len(get_compatible(pos, fixed_positions, distance))
+                  == offset]
+        if len(usable) < count: return None
+        neighbours = dict()
+        for pos in usable:
+            neighbours[pos] = [other for other
+                               in get_compatible(pos, usable, distance)
+                               if other != pos]
+        # Try the candidates with the most compatible ones first.
+        usable.sort(key=lambda pos: -len(neighbours[pos]))
+        bit = dict([(pos, 1 << n) for n, pos in enumerate(usable)])
+        compatible = [sum([bit[other] for other in neighbours[pos]])
+                      for pos in usable]
+        found = find_clique(compatible, count, max_nodes=max_nodes)
+        if found is None: return None
+        return sorted([usable[n] for n in found])
+
+    low = min_hamming
+    high = max([max(row) for row in separations] or [low])
+    found = solve(low)
+    if found is None: return None
+    while low < high:
+        middle = (low + high + 1) / 2
+        result = solve(middle)
+        if result is None:
+            high = middle - 1
+        else:
+            found, low = result, middle
+    # The actual minimum distance may be larger than the one required.
+    chosen = range(offset) + found
+    distance = min([separations[pos1][pos2]
+                    for n, pos1 in enumerate(chosen)
+                    for pos2 in chosen[n+1:]])
+    return [pos - offset for pos in found], distance
+
+def assign_indexes(count, kitnames, fixed=[], min_hamming=3,
+                   min_levenshtein=2, registry=REGISTRY, max_nodes=MAX_NODES):
+    """Return the tuple (assignments, distance), where assignments is the
+    list of tuples (name, sequence) of 'count' indexes from the kits, and
+    distance is the minimum Hamming distance between any of them and the
+    fixed index sequences, which is as large as could be found, or None
+    if there are no pairs.
+    The candidates must have the same length as the fixed index sequences;
+    if there are none, the best of the lengths in the kits is used.
+    Raise ValueError if no assignment satisfies the minimum distances."""
+    fixed = sorted(set(fixed))
+    candidates = [c for c in get_candidates(kitnames, registry)
+                  if c[1] not in fixed]
+    if fixed:
+        lengths = [len(fixed[0])]
+    else:
+        lengths = sorted(set([len(c[1]) for c in candidates]))
+    best = None
+    for length in lengths:
+        group = [c for c in candidates if len(c[1]) == length]
+        if len(group) < count: continue
+        if count + len(fixed) < 2:
+            return group[:count], None
+        result = _solve(count, group, fixed,
+                        min_hamming, min_levenshtein, max_nodes)
+        if result is None: continue
+        if best is None or result[1] > best[1]:
+            best = ([group[pos] for pos in result[0]], result[1])
+    if best is None:
+        raise ValueError("no assignment of %i indexes from kits %s with"
+                         " minimum Hamming distance %i" %
+                         (count, ', '.join(kitnames), min_hamming))
+    return best
@@ -48,14 +48,6 @@ ILLUMINA = dict(index1='ATCACG',
                 index25='ACTGAT',
                 # index26 is "reserved" by Illumina
                 index27='ATTCCT')
-BASIC_LOOKUP.update(ILLUMINA)
-INDEX_LOOKUP.update(ILLUMINA)
-INDEX_LOOKUP.update(dict([(k.replace('index', 'idx'), v)
-                          for k,v in ILLUMINA.items()]))
-INDEX_LOOKUP.update(dict([(k.replace('index', 'in'), v)
-                          for k,v in ILLUMINA.items()]))
-INDEX_LOOKUP.update(dict([(k.replace('index', 'i'), v)
-                          for k,v in ILLUMINA.items()]))
 
 # rpi1-rpi48 are from the table "TruSeq Small RNA Sample Prep Kits",
 # after reverse-complement conversion.
@@ -110,12 +102,6 @@ RPI = dict(rpi1='ATCACG',
            rpi46='TCCCGA',
            rpi47='TCGAAG',
            rpi48='TCGGCA')
-BASIC_LOOKUP.update(RPI)
-INDEX_LOOKUP.update(RPI)
-INDEX_LOOKUP.update(dict([(k.replace('rpi', 'r'), v)
-                          for k,v in RPI.items()]))
-INDEX_LOOKUP.update(dict([(k.replace('rpi', 'indexr'), v)
-                          for k,v in RPI.items()]))
 
 # The Agilent indexes agilent1-agilent96 are from the Google Docs spreadsheet
 # "illumina 96 barcodes plate format_column arrangement" by Joel Gruselius.
@@ -216,12 +202,6 @@ AGILENT = dict(agilent1='ATCACG',
                agilent94='CCGTCC',
                agilent95='ATTCCT',
                agilent96='AGGTTT')
-BASIC_LOOKUP.update(AGILENT)
-INDEX_LOOKUP.update(AGILENT)
-INDEX_LOOKUP.update(dict([(k.replace('agilent', 'a'), v)
-                          for k,v in AGILENT.items()]))
-INDEX_LOOKUP.update(dict([(k.replace('agilent', 'indexa'), v)
-                          for k,v in AGILENT.items()]))
 
 # Indexes mondrian1-mondrian16 are from the PDF "User Guide for ovation
 # SP Ultralow Library System" a.k.a. Mondrian system.
@@ -242,12 +222,6 @@ MONDRIAN = dict(mondrian1='AAGGGA',
                 mondrian14='CACCTC',
                 mondrian15='GTGGCC',
                 mondrian16='TGTTGC')
-BASIC_LOOKUP.update(MONDRIAN)
-INDEX_LOOKUP.update(MONDRIAN)
-INDEX_LOOKUP.update(dict([(k.replace('mondrian', 'm'), v)
-                          for k,v in MONDRIAN.items()]))
-INDEX_LOOKUP.update(dict([(k.replace('mondrian', 'indexm'), v)
-                          for k,v in MONDRIAN.items()]))
 
 # Indexes halo1-halo96 are from the PDF "Haloplex PCR Target Enrichment &
 # Library Preparation Guide, Version 2.0, November 2011"
@@ -348,12 +322,6 @@ HALO = dict(halo1='CTCGGT',
             halo94='ATCAGT',
             halo95='GGCGCT',
             halo96='ACTTAT')
-BASIC_LOOKUP.update(HALO)
-INDEX_LOOKUP.update(HALO)
-INDEX_LOOKUP.update(dict([(k.replace('halo', 'h'), v)
-                          for k,v in HALO.items()]))
-INDEX_LOOKUP.update(dict([(k.replace('halo', 'indexh'), v)
-                          for k,v in HALO.items()]))
 
 # Indexes haloht1-haloht96 are the new 8-bp indexes for Haloplex.
 # From a CSV file "oligo_reference-halo8.csv" provided by Joel Gruselius.
@@ -454,10 +422,6 @@ HALOHT = dict(haloht1='AACGTGAT',
               haloht94='GAGTTAGC',
               haloht95='GATGAATC',
               haloht96='GCCAAGAC')
-BASIC_LOOKUP.update(HALOHT)
-INDEX_LOOKUP.update(HALOHT)
-INDEX_LOOKUP.update(dict([(k.replace('haloht', 'hht'), v)
-                          for k,v in HALOHT.items()]))
 
 # Indexes sureselect1-sureselect16 are the 16 SureSelect indexes.
 # From a CSV file "oligo_reference-halo8.csv" provided by Joel Gruselius.
@@ -478,10 +442,6 @@ SURESELECT = dict(sureselect1='ATCACG',
                   sureselect14='CAAAAG',
                   sureselect15='GAAACC',
                   sureselect16='AAAGCA')
-BASIC_LOOKUP.update(SURESELECT)
-INDEX_LOOKUP.update(SURESELECT)
-INDEX_LOOKUP.update(dict([(k.replace('sureselect', 'ss'), v)
-                          for k,v in SURESELECT.items()]))
 
 # Indexes for TruSeq DNA HT Dual D7-D5
 # From the CSV file written out from GenoLogics LIMS 2013-01-24.
@@ -582,8 +542,6 @@ DUAL = dict(dual1='ATTACTCG-TATAGCCT',
             dual94='AGCGATAG-TAATCTTA',
             dual95='AGCGATAG-CAGGACGT',
             dual96='AGCGATAG-GTACTGAC')
-BASIC_LOOKUP.update(DUAL)
-INDEX_LOOKUP.update(DUAL)
 
 # Indexes for Nextera Dual HT.
 # From CSV file provided by Sverker Lundin 2013-05-02
@@ -1048,8 +1006,6 @@ NEXTERADUAL.update(dict(
         nxdual454='TCGACGTC-TTATGCGA',
         )
                    )
-BASIC_LOOKUP.update(NEXTERADUAL)
-INDEX_LOOKUP.update(NEXTERADUAL)
 
 
 # Indexes converting Haloplex to dual
@@ -1058,8 +1014,6 @@ HALOHTDUAL = dict()
 suffix = '-TCTTTCCC'
 for key, value in HALOHT.iteritems():
     HALOHTDUAL[key + 'dual'] = value + suffix
-BASIC_LOOKUP.update(HALOHTDUAL)
-INDEX_LOOKUP.update(HALOHTDUAL)
 
 
 # Illumina indexes converted to dual.
@@ -1089,8 +1043,6 @@ ILLUMINADUAL = dict(index1dual='ATCACGAT-TCTTTCCC',
                     index23dual='GAGTGGAT-TCTTTCCC',
                     index25dual='ACTGATAT-TCTTTCCC',
                     index27dual='ATTCCTTT-TCTTTCCC')
-BASIC_LOOKUP.update(ILLUMINADUAL)
-INDEX_LOOKUP.update(ILLUMINADUAL)
 
 # SureSelect XT indexes
 # From table 85 on page 158 of http://www.chem.agilent.com/library/usermanuals/public/g7550-90000.pdf
@@ -1190,10 +1142,32 @@ SURESELECT_XT = dict(xta01='ATGCCTAA',
                     xth10='ACAGATTC',
                     xth11='AATCCGTC',
                     xth12='ACAAGCTA')
-BASIC_LOOKUP.update(SURESELECT_XT)
-INDEX_LOOKUP.update(SURESELECT_XT)
 
 
+# The kit families, in order of precedence. Each entry gives the name of
+# the kit, its definitions, the prefix of its primary index names, and
+# the alternative prefixes accepted in index specifications.
+# This table is compiled into the registry by index_registry.py.
+KITS = [('ILLUMINA', ILLUMINA, 'index', ('idx', 'in', 'i')),
+        ('RPI', RPI, 'rpi', ('r', 'indexr')),
+        ('AGILENT', AGILENT, 'agilent', ('a', 'indexa')),
+        ('MONDRIAN', MONDRIAN, 'mondrian', ('m', 'indexm')),
+        ('HALO', HALO, 'halo', ('h', 'indexh')),
+        ('HALOHT', HALOHT, 'haloht', ('hht',)),
+        ('SURESELECT', SURESELECT, 'sureselect', ('ss',)),
+        ('DUAL', DUAL, 'dual', ()),
+        ('NEXTERADUAL', NEXTERADUAL, 'nxdual', ()),
+        ('HALOHTDUAL', HALOHTDUAL, 'haloht', ()),
+        ('ILLUMINADUAL', ILLUMINADUAL, 'index', ()),
+        ('SURESELECT_XT', SURESELECT_XT, 'xt', ())]
+
+for kitname, kit, prefix, aliases in KITS:
+    BASIC_LOOKUP.update(kit)
+    INDEX_LOOKUP.update(kit)
+    for alias in aliases:
+        INDEX_LOOKUP.update(dict([(k.replace(prefix, alias), v)
+                                  for k,v in kit.items()]))
+
 # Finally, allow all upper-case variants of index designations.
 INDEX_LOOKUP.update(dict([(k.upper(), v)
                           for k,v in INDEX_LOOKUP.items()]))
@@ -0,0 +1,218 @@
+"""Precomputed mismatch-neighbourhood index of index sequences.
+
+For every sequence added to the index, all variants having at most
+'max_mismatches' substitutions are precomputed into hash tables, so
+that finding the sequences within k mismatches of a given sequence is
+a dictionary probe instead of a loop over all pairs.
+
+Only sequences of equal length are compared, as for the Hamming distance.
+Positions holding other characters than ACGT (such as the '-' separating
+dual indexes) are never substituted; they must be the same in all
+sequences of a given length for the probe to be used. Otherwise, and for
+queries containing other characters (such as N), the sequences of the
+given length are scanned instead, using the packed 2-bit encoding
+when possible. The answer is the same either way.
+
+The index for the registry is built lazily, per sequence length, and
+cached on disk.
+"""
+
+import hashlib
+import marshal
+import os
+
+from index_registry import DIRPATH, get_sequences, write_atomically
+from index_packing import PackedSequences
+
+# Directory for the cached registry neighbourhood files.
+CACHE_DIR = DIRPATH
+
+# Maximum number of mismatches precomputed by default.
+MAX_MISMATCHES = 2
+
+BASES = 'ACGT'
+
+
+def get_template(sequence):
+    "Return the dictionary of positions and characters other than ACGT."
+    return dict([(pos, ch) for pos, ch in enumerate(sequence)
+                 if ch not in BASES])
+
+def get_neighbourhood(sequence, mismatches):
+    """Return the list of all variants of the sequence having exactly
+    the given number of substitutions in the ACGT positions."""
+    positions = [pos for pos, ch in enumerate(sequence) if ch in BASES]
+    result = []
+    if mismatches <= 0:
+        result.append(sequence)
+        return result
+    chars = list(sequence)
+    def substitute(start, remaining):
+        for i in xrange(start, len(positions)):
+            pos = positions[i]
+            original = chars[pos]
+            for base in BASES:
+                if base == original: continue
+                chars[pos] = base
+                if remaining == 1:
+                    result.append(''.join(chars))
+                else:
+                    substitute(i + 1, remaining - 1)
+            chars[pos] = original
+    substitute(0, mismatches)
+    return result
+
+def count_mismatches(s1, s2):
+    "Return the number of mismatches between two sequences of equal length."
+    return sum(ch1 != ch2 for ch1, ch2 in zip(s1, s2))
+
+
+class _Bucket(object):
+    "The neighbourhood tables for all sequences of one length."
+
+    def __init__(self, max_mismatches):
+        self.sequences = set()
+        self.template = None
+        self.regular = True
+        self.packed = None              # Packed sequences for scanning
+        # One table per number of mismatches; key: variant,
+        # value: sequence, or tuple of sequences if more than one.
+        self.lookups = [dict() for i in xrange(max_mismatches + 1)]
+
+    def add(self, sequence):
+        if sequence in self.sequences: return
+        self.sequences.add(sequence)
+        self.packed = None
+        template = get_template(sequence)
+        if self.template is None:
+            self.template = template
+        elif template != self.template:
+            self.regular = False
+        for mismatches, lookup in enumerate(self.lookups):
+            for variant in get_neighbourhood(sequence, mismatches):
+                try:
+                    found = lookup[variant]
+                except KeyError:
+                    lookup[variant] = sequence
+                else:
+                    if isinstance(found, tuple):
+                        lookup[variant] = found + (sequence,)
+                    else:
+                        lookup[variant] = (found, sequence)
+
+    def get(self, sequence, mismatches):
+        "Return a dictionary of the sequences within the mismatches."
+        result = dict()
+        if self.regular and mismatches < len(self.lookups) and \
+           get_template(sequence) == self.template:
+            for distance in xrange(mismatches + 1):
+                found = self.lookups[distance].get(sequence)
+                if found is None: continue
+                if isinstance(found, tuple):
+                    for other in found:
+                        result[other] = distance
+                else:
+                    result[found] = distance
+        else:
+            try:
+                if self.packed is None:
+                    self.packed = PackedSequences(len(sequence),
+                                                  self.sequences)
+                result.update(self.packed.distances(sequence, mismatches))
+            except ValueError:
+                for other in self.sequences:
+                    distance = count_mismatches(sequence, other)
+                    if distance <= mismatches:
+                        result[other] = distance
+        return result
+
+
+class MismatchIndex(object):
+    "Index of sequences allowing lookup of those within k mismatches."
+
+    def __init__(self, sequences=[], max_mismatches=MAX_MISMATCHES):
+        self.max_mismatches = max_mismatches
+        self.buckets = dict()           # Key: sequence length
+        for sequence in sequences:
+            self.add(sequence)
+
+    def __contains__(self, sequence):
+        try:
+            return sequence in self.buckets[len(sequence)].sequences
+        except KeyError:
+            return False
+
+    def get_bucket(self, length):
+        "Return the bucket for the sequence length, or None."
+        return self.buckets.get(length)
+
+    def add(self, sequence):
+        "Add the sequence to the index."
+        try:
+            bucket = self.buckets[len(sequence)]
+        except KeyError:
+            bucket = self.buckets[len(sequence)] = _Bucket(self.max_mismatches)
+        bucket.add(sequence)
+
+    def get(self, sequence, mismatches=None):
+        """Return a dictionary of the indexed sequences of the same length
+        that are within the given number of mismatches of the sequence.
+        Key: indexed sequence, value: number of mismatches.
+        The number of mismatches defaults to the maximum precomputed."""
+        if mismatches is None:
+            mismatches = self.max_mismatches
+        bucket = self.get_bucket(len(sequence))
+        if bucket is None:
+            return dict()
+        return bucket.get(sequence, mismatches)
+
+
+class RegistryMismatchIndex(MismatchIndex):
+    """Mismatch index of the registry sequences. The bucket for a sequence
+    length is built on first use, and cached on disk, keyed by a checksum
+    of the registry sequences of that length."""
+
+    def __init__(self, max_mismatches=MAX_MISMATCHES, cache_dir=CACHE_DIR):
+        super(RegistryMismatchIndex, self).__init__(max_mismatches=max_mismatches)
+        self.cache_dir = cache_dir
+
+    def get_bucket(self, length):
+        try:
+            return self.buckets[length]
+        except KeyError:
+            pass
+        sequences = sorted(get_sequences(length))
+        if not sequences:
+            return None
+        digest = hashlib.md5('\n'.join(sequences)).hexdigest()
+        filepath = os.path.join(self.cache_dir,
+                                "neighbourhood-%i-%i.dat" %
+                                (length, self.max_mismatches))
+        bucket = _Bucket(self.max_mismatches)
+        try:
+            cached = marshal.load(open(filepath, 'rb'))
+            if cached[0] != digest: raise ValueError
+            bucket.template, bucket.regular, bucket.lookups = cached[1:]
+            bucket.sequences = set(sequences)
+        except (IOError, EOFError, ValueError, TypeError):
+            for sequence in sequences:
+                bucket.add(sequence)
+            try:
+                write_atomically(filepath,
+                                 marshal.dumps((digest, bucket.template,
+                                                bucket.regular,
+                                                bucket.lookups)))
+            except (IOError, OSError):
+                pass
+        self.buckets[length] = bucket
+        return bucket
+
+
+_registry_index = None
+
+def get_registry_index():
+    "Return the shared mismatch-neighbourhood index of the registry."
+    global _registry_index
+    if _registry_index is None:
+        _registry_index = RegistryMismatchIndex()
+    return _registry_index
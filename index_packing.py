@@ -0,0 +1,122 @@
+"""Packed 2-bit encoding of index sequences.
+
+Each base is stored in 2 bits of an integer: A=0, C=1, G=2, T=3.
+Positions holding N or '-' are flagged in a side mask, with N=0 and '-'=1
+in the bits, so that the Hamming distance between two packed sequences
+of equal length is an XOR followed by a popcount.
+"""
+
+from index_registry import get_sequences
+
+CODES = dict(A=0, C=1, G=2, T=3)
+MASKED_CODES = {'N': 0, '-': 1}
+CHARS = 'ACGT'
+MASKED_CHARS = 'N-'
+
+
+def pack(sequence):
+    """Return the packed tuple (bits, mask) for the sequence.
+    Raise ValueError if it contains other characters than ACGTN-."""
+    bits = 0
+    mask = 0
+    for pos, ch in enumerate(sequence):
+        shift = 2 * pos
+        try:
+            bits |= CODES[ch] << shift
+        except KeyError:
+            try:
+                bits |= MASKED_CODES[ch] << shift
+            except KeyError:
+                raise ValueError("cannot pack character %r" % ch)
+            mask |= 3 << shift
+    return bits, mask
+
+def unpack(packed, length):
+    "Return the sequence string for the packed tuple (bits, mask)."
+    bits, mask = packed
+    chars = []
+    for pos in xrange(length):
+        shift = 2 * pos
+        code = (bits >> shift) & 3
+        if (mask >> shift) & 3:
+            chars.append(MASKED_CHARS[code])
+        else:
+            chars.append(CHARS[code])
+    return ''.join(chars)
+
+def get_low_bits(length):
+    "Return the integer with the low bit of each 2-bit position set."
+    return int('01' * length, 2) if length else 0
+
+def popcount(value):
+    "Return the number of bits set in the non-negative integer."
+    return bin(value).count('1')
+
+def packed_distance(packed1, packed2, low_bits):
+    """Return the Hamming distance between two packed sequences of equal
+    length. 'low_bits' is the result of get_low_bits for the length."""
+    diff = (packed1[0] ^ packed2[0]) | (packed1[1] ^ packed2[1])
+    return popcount((diff | (diff >> 1)) & low_bits)
+
+
+class PackedSequences(object):
+    "Packed sequences of equal length, for comparison in batch."
+
+    def __init__(self, length, sequences=[]):
+        self.length = length
+        self.low_bits = get_low_bits(length)
+        self.sequences = []
+        self.bits = []
+        self.masks = []
+        for sequence in sequences:
+            self.add(sequence)
+
+    def __len__(self):
+        return len(self.sequences)
+
+    def add(self, sequence):
+        "Add the sequence. Raise ValueError if it cannot be packed."
+        if len(sequence) != self.length:
+            raise ValueError('sequence of wrong length')
+        bits, mask = pack(sequence)
+        self.sequences.append(sequence)
+        self.bits.append(bits)
+        self.masks.append(mask)
+
+    def distances(self, sequence, max_distance=None):
+        """Return the list of tuples (sequence, Hamming distance) for all
+        sequences compared with the given one, or only those within
+        'max_distance', if given. Raise ValueError if the given sequence
+        has the wrong length or cannot be packed."""
+        if len(sequence) != self.length:
+            raise ValueError('sequence of wrong length')
+        qbits, qmask = pack(sequence)
+        low_bits = self.low_bits
+        diffs = [(b ^ qbits) | (m ^ qmask)
+                 for b, m in zip(self.bits, self.masks)]
+        counts = [bin((d | (d >> 1)) & low_bits).count('1') for d in diffs]
+        if max_distance is None:
+            return zip(self.sequences, counts)
+        return [(s, c) for s, c in zip(self.sequences, counts)
+                if c <= max_distance]
+
+
+# Key: sequence length, value: PackedSequences of the registry sequences.
+_registry_packed = dict()
+
+def get_registry_packed(length):
+    "Return the packed registry sequences of the given length."
+    try:
+        return _registry_packed[length]
+    except KeyError:
+        result = _registry_packed[length] = \
+            PackedSequences(length, sorted(get_sequences(length)))
+        return result
+
+def get_registry_distances(sequence, max_distance=None):
+    """Return the list of tuples (registry sequence, Hamming distance)
+    for the registry sequences of the same length as the given one,
+    within 'max_distance', if given. Raise ValueError if the sequence
+    cannot be packed."""
+    return get_registry_packed(len(sequence)).distances(sequence,
+                                                        max_distance)
@@ -0,0 +1,492 @@
+"""Compiled registry of the sequence index definitions.
+
+The kit definitions in index_definitions are compiled by a build step
+into a versioned, checksummed registry file, which is loaded in one go
+instead of re-executing the definitions module in every process.
+Conflicting index names and duplicate aliases are detected when compiling.
+
+The definitions of each kit are stored separately in the registry file,
+and are unpacked only when an index name or specification of that kit
+is first looked up; BASIC_LOOKUP and INDEX_LOOKUP are read-only mapping
+facades over the kits.
+
+Index specifications such as 'hht31', 'A14' or 'indexr6' are resolved
+by parsing them into prefix, number and suffix, case-folded, and looking
+up the prefix and suffix in a compiled table giving the kit and the
+prefix and suffix of its index names. Only the index names themselves
+are stored, not every alias.
+
+To (re)build the registry file:
+
+    python index_registry.py
+
+Additional kits may be defined in CSV or JSON files in the directory
+KITS_DIR. A CSV file has the columns 'Index' and 'Sequence'; the kit is
+named after the file. A JSON file holds an object with the items 'kit'
+(optional, defaults to the file name), 'prefix' (optional), 'aliases'
+(optional list of alternative prefixes) and 'indexes' (an object with
+the index names and sequences). The index names must follow the usual
+convention of prefix, number and optional suffix, e.g. 'mykit12'; they
+are converted to lower case. A kit file that cannot be read, or that
+conflicts with other kits, e.g. by defining a kit name already in use,
+is skipped with a warning.
+
+The kits of each source file, including index_definitions.py itself,
+are compiled into the cache file KITS_CACHE_FILE, keyed by the file
+modification time, size and checksum, so that only new or changed
+source files are read when the registry is rebuilt.
+
+If the registry file is missing, of another version, corrupt or older
+than any of the source files, it is rebuilt in memory, and an attempt
+is made to write it for the next process.
+"""
+
+import hashlib
+import marshal
+import os
+import re
+from UserDict import DictMixin
+
+# Bump this whenever the layout of the compiled payload changes.
+REGISTRY_VERSION = 5
+REGISTRY_MAGIC = 'samplesheet-index-registry'
+
+DIRPATH = os.path.dirname(os.path.abspath(__file__))
+REGISTRY_FILE = os.path.join(DIRPATH, 'index_registry.dat')
+SOURCE_FILE = os.path.join(DIRPATH, 'index_definitions.py')
+KITS_DIR = os.path.join(DIRPATH, 'kits')
+KITS_CACHE_FILE = os.path.join(DIRPATH, 'kits_cache.dat')
+KIT_FILE_EXTENSIONS = ('.csv', '.json')
+
+# Characters allowed in an index sequence; '-' separates dual indexes.
+SEQUENCE_CHARS = set('ACGT-')
+
+# Index names and specifications: prefix, number and optional suffix.
+NAME_RX = re.compile(r'^(\D+)(\d+)(\D*)$')
+
+
+def get_file_digest(filepath):
+    "Return the checksum of the contents of the file."
+    return hashlib.md5(open(filepath, 'rb').read()).hexdigest()
+
+def get_sources():
+    "Return the list of source files: the definitions, then the kit files."
+    result = [SOURCE_FILE]
+    try:
+        filenames = sorted(os.listdir(KITS_DIR))
+    except OSError:
+        return result
+    for filename in filenames:
+        if os.path.splitext(filename)[1].lower() in KIT_FILE_EXTENSIONS:
+            result.append(os.path.join(KITS_DIR, filename))
+    return result
+
+def get_source_signature(filepath, previous=None):
+    """Return the tuple (filepath, mtime, size, checksum) for the file.
+    The checksum is taken from the previous signature, if the
+    modification time and size are unchanged."""
+    stat = os.stat(filepath)
+    if previous and previous[1:3] == (stat.st_mtime, stat.st_size):
+        digest = previous[3]
+    else:
+        digest = get_file_digest(filepath)
+    return (filepath, stat.st_mtime, stat.st_size, digest)
+
+def get_default_prefix(names):
+    "Return the prefix common to the given index names."
+    prefixes = []
+    for name in names:
+        match = NAME_RX.match(name)
+        if not match:
+            raise ValueError("invalid index name %s" % name)
+        prefixes.append(match.group(1))
+    return os.path.commonprefix(prefixes)
+
+def read_kit_file(filepath):
+    """Return the list of the kit defined in the CSV or JSON file.
+    Raise ValueError if it cannot be read or is invalid."""
+    # Imported here, since only rebuilding the registry reads kit files.
+    import csv
+    import json
+    basename, extension = os.path.splitext(os.path.basename(filepath))
+    kitname = basename.upper()
+    aliases = ()
+    try:
+        if extension.lower() == '.json':
+            data = json.load(open(filepath))
+            kitname = str(data.get('kit', kitname)).upper()
+            kit = dict([(str(name).strip().lower(), str(sequence).upper())
+                        for name, sequence in data['indexes'].items()])
+            prefix = data.get('prefix')
+            aliases = tuple([str(alias) for alias in data.get('aliases', [])])
+        else:
+            reader = csv.reader(open(filepath, 'rU'))
+            header = [h.strip().lower() for h in reader.next()]
+            name_pos = header.index('index')
+            sequence_pos = header.index('sequence')
+            kit = dict()
+            for record in reader:
+                if not record: continue
+                kit[record[name_pos].strip().lower()] = \
+                    record[sequence_pos].strip().upper()
+            prefix = None
+    except (IOError, ValueError, KeyError, IndexError, AttributeError,
+            StopIteration, csv.Error), msg:
+        raise ValueError("cannot read kit file %s: %s" % (filepath, msg))
+    if not kit:
+        raise ValueError("no indexes in kit file %s" % filepath)
+    if prefix is None:
+        prefix = get_default_prefix(kit)
+    return [(kitname, kit, str(prefix), aliases)]
+
+def read_source_kits(filepath):
+    "Return the list of kits defined in the source file."
+    if filepath == SOURCE_FILE:
+        from index_definitions import KITS
+        return [(kitname, kit, prefix, tuple(aliases))
+                for kitname, kit, prefix, aliases in KITS]
+    else:
+        return read_kit_file(filepath)
+
+def load_kits():
+    """Return the list of tuples (signature, kits) for all source files.
+    The kits of a source file are read only if it is not in the cache
+    with the same signature; the cache is updated, if possible.
+    A kit file that cannot be read is given with kits None."""
+    import logging
+    try:
+        cache = marshal.load(open(KITS_CACHE_FILE, 'rb'))
+        if cache.get('version') != REGISTRY_VERSION: raise ValueError
+    except (IOError, EOFError, ValueError, TypeError, AttributeError):
+        cache = dict(version=REGISTRY_VERSION)
+    result = []
+    changed = False
+    for filepath in get_sources():
+        try:
+            previous, kits = cache[filepath]
+        except KeyError:
+            previous = kits = None
+        signature = get_source_signature(filepath, previous)
+        if previous is None or signature[3] != previous[3]:
+            try:
+                kits = read_source_kits(filepath)
+            except ValueError, msg:
+                logging.warning("skipping kit file: %s", msg)
+                kits = None
+        if signature != previous:
+            cache[filepath] = (signature, kits)
+            changed = True
+        result.append((signature, kits))
+    for filepath in cache.keys():
+        if filepath != 'version' and \
+           filepath not in [r[0][0] for r in result]:
+            del cache[filepath]
+            changed = True
+    if changed:
+        try:
+            write_atomically(KITS_CACHE_FILE, marshal.dumps(cache))
+        except (IOError, OSError):
+            pass
+    return result
+
+def compile_registry(kits):
+    """Compile the given list of kits into the registry payload.
+    Each kit is a tuple (kitname, definitions, prefix, aliases).
+    Raise ValueError if a kit name, an index name or alias is defined more
+    than once, if the prefix of a name is used by more than one kit, or if
+    a name or a sequence is invalid."""
+    basic = dict()
+    origin = dict()                     # Key: lower-case name, value: kit
+    # Key: (spec prefix, spec suffix), value: (kit, name prefix, name suffix)
+    specs = dict()
+    kitdata = dict()
+    index_count = 0
+    for kitname, kit, prefix, aliases in kits:
+        if kitname in kitdata:
+            raise ValueError("kit %s defined more than once" % kitname)
+        kitdata[kitname] = None
+        for name, sequence in kit.iteritems():
+            if set(sequence).difference(SEQUENCE_CHARS):
+                raise ValueError("invalid sequence for %s in kit %s: %s"
+                                 % (name, kitname, sequence))
+            if name in basic:
+                raise ValueError("conflicting index name %s in kits %s and %s"
+                                 % (name, origin[name.lower()], kitname))
+            basic[name] = sequence
+            match = NAME_RX.match(name)
+            if not match or name != name.lower():
+                raise ValueError("invalid index name %s in kit %s"
+                                 % (name, kitname))
+            target = (kitname, match.group(1), match.group(3))
+            names = [name]
+            for alias in aliases:
+                if not name.startswith(prefix):
+                    raise ValueError("index name %s in kit %s lacks prefix %s"
+                                     % (name, kitname, prefix))
+                names.append(name.replace(prefix, alias))
+            for alias in names:
+                try:
+                    other = origin[alias.lower()]
+                except KeyError:
+                    origin[alias.lower()] = kitname
+                else:
+                    raise ValueError("duplicate alias %s in kits %s and %s"
+                                     % (alias, other, kitname))
+                match = NAME_RX.match(alias.lower())
+                if not match:
+                    raise ValueError("invalid index name %s in kit %s"
+                                     % (alias, kitname))
+                key = (match.group(1), match.group(3))
+                other = specs.setdefault(key, target)
+                if other != target:
+                    raise ValueError("prefix of %s used by kits %s and %s"
+                                     % (alias, other[0], kitname))
+                index_count += 2        # Lower- and upper-case
+        kitdata[kitname] = marshal.dumps(dict(kit))
+    return dict(kits=[(kitname, prefix, tuple(aliases))
+                      for kitname, kit, prefix, aliases in kits],
+                specs=specs,
+                kitdata=kitdata,
+                basic_count=len(basic),
+                index_count=index_count,
+                sequences=marshal.dumps(compile_sequences(basic)))
+
+def compile_sequences(basic):
+    """Compile the reverse index from sequence to index names.
+    Key: sequence length, value: dict with key sequence, value: sorted
+    tuple of the names of the indexes having that sequence."""
+    result = dict()
+    for name, sequence in basic.iteritems():
+        bucket = result.setdefault(len(sequence), dict())
+        bucket.setdefault(sequence, []).append(name)
+    for bucket in result.itervalues():
+        for sequence, names in bucket.items():
+            bucket[sequence] = tuple(sorted(names))
+    return result
+
+def build_registry(sources=None):
+    """Compile the registry payload from the kits of the source files,
+    as given by load_kits. Return the tuple (payload, signatures).
+    A kit file conflicting with the kits before it is skipped."""
+    import logging
+    if sources is None:
+        sources = load_kits()
+    kits = []
+    for signature, source_kits in sources:
+        if source_kits is None: continue
+        if signature[0] != SOURCE_FILE:
+            try:
+                compile_registry(kits + source_kits)
+            except ValueError, msg:
+                logging.warning("skipping kit file %s: %s", signature[0], msg)
+                continue
+        kits.extend(source_kits)
+    return compile_registry(kits), [s[0] for s in sources]
+
+def write_atomically(filepath, content):
+    "Write the content to the file, replacing it atomically."
+    tmppath = "%s.%i.tmp" % (filepath, os.getpid())
+    outfile = open(tmppath, 'wb')
+    try:
+        outfile.write(content)
+    finally:
+        outfile.close()
+    os.rename(tmppath, filepath)
+
+def write_registry(payload, signatures, filepath=REGISTRY_FILE):
+    """Write the payload to the registry file, along with the version,
+    the checksum of the payload and the signatures of the source files."""
+    data = marshal.dumps(payload)
+    write_atomically(filepath, marshal.dumps((REGISTRY_MAGIC,
+                                              REGISTRY_VERSION,
+                                              hashlib.md5(data).hexdigest(),
+                                              signatures,
+                                              data)))
+
+def read_registry(filepath=REGISTRY_FILE):
+    """Read the payload from the registry file.
+    Raise ValueError if it is of another version, corrupt, or compiled
+    from other source files than the current ones."""
+    try:
+        content = open(filepath, 'rb').read()
+    except IOError, msg:
+        raise ValueError("cannot read registry: %s" % msg)
+    try:
+        magic, version, checksum, signatures, data = marshal.loads(content)
+    except (EOFError, ValueError, TypeError):
+        raise ValueError('corrupt registry file')
+    if magic != REGISTRY_MAGIC:
+        raise ValueError('not a registry file')
+    if version != REGISTRY_VERSION:
+        raise ValueError("registry version %s, expected %s"
+                         % (version, REGISTRY_VERSION))
+    if hashlib.md5(data).hexdigest() != checksum:
+        raise ValueError('registry checksum mismatch')
+    sources = get_sources()
+    if sources != [s[0] for s in signatures]:
+        raise ValueError('registry is stale')
+    try:
+        for signature in signatures:
+            current = get_source_signature(signature[0], signature)
+            if current[3] != signature[3]:
+                raise ValueError('registry is stale')
+    except (IOError, OSError):
+        raise ValueError('registry is stale')
+    return marshal.loads(data)
+
+def load_registry(filepath=REGISTRY_FILE):
+    """Return the registry payload, from the registry file if it is valid,
+    else compiled from the source files and saved, if possible."""
+    try:
+        return read_registry(filepath)
+    except ValueError:
+        payload, signatures = build_registry()
+        try:
+            write_registry(payload, signatures, filepath)
+        except (IOError, OSError):
+            pass
+        return payload
+
+
+class KitRegistry(object):
+    "The compiled registry, unpacking the definitions of a kit on demand."
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.specs = payload['specs']
+        self.kits = dict()              # Key: kitname, value: definitions
+        self.sequences = None
+
+    def get_kitnames(self):
+        "Return the list of the names of the kits, in order of precedence."
+        return [kit[0] for kit in self.payload['kits']]
+
+    def resolve(self, spec):
+        """Return the tuple (kitname, index name) for the index name or
+        specification, irrespective of case. Raise KeyError if it is not
+        a valid specification for any kit."""
+        try:
+            match = NAME_RX.match(spec.lower())
+        except AttributeError:          # Not a string
+            raise KeyError(spec)
+        if not match:
+            raise KeyError(spec)
+        kitname, prefix, suffix = self.specs[(match.group(1),
+                                              match.group(3))]
+        name = prefix + match.group(2) + suffix
+        if name not in self.get_kit(kitname):
+            raise KeyError(spec)
+        return kitname, name
+
+    def get_kit(self, kitname):
+        """Return the definitions of the kit, unpacking it if not done
+        already. Do not modify it!"""
+        try:
+            return self.kits[kitname]
+        except KeyError:
+            result = self.kits[kitname] = \
+                marshal.loads(self.payload['kitdata'][kitname])
+            return result
+
+    def iter_names(self):
+        "Iterate over all index names, kit by kit."
+        for kitname in self.get_kitnames():
+            for name in self.get_kit(kitname):
+                yield name
+
+    def iter_specs(self):
+        """Iterate over all index specifications, kit by kit,
+        in lower- and upper-case."""
+        specs = sorted(self.specs.items())
+        for kitname in self.get_kitnames():
+            for name in self.get_kit(kitname):
+                match = NAME_RX.match(name)
+                target = (kitname, match.group(1), match.group(3))
+                for (prefix, suffix), found in specs:
+                    if found != target: continue
+                    spec = prefix + match.group(2) + suffix
+                    yield spec
+                    yield spec.upper()
+
+    def get_sequence_lookup(self):
+        "Return the reverse index from sequence to index names."
+        if self.sequences is None:
+            self.sequences = marshal.loads(self.payload['sequences'])
+        return self.sequences
+
+
+class KitLookup(DictMixin):
+    """Read-only mapping facade over either the index names or the index
+    specifications of all kits in the registry, giving the sequence.
+    Looking up a key unpacks only the kit it belongs to."""
+
+    def __init__(self, registry, specs, count):
+        self.registry = registry
+        self.specs = specs
+        self.count = count
+
+    def __getitem__(self, key):
+        kitname, name = self.registry.resolve(key)
+        if not self.specs and name != key:
+            raise KeyError(key)
+        return self.registry.get_kit(kitname)[name]
+
+    def __setitem__(self, key, value):
+        raise TypeError('the index registry is read-only')
+
+    def __delitem__(self, key):
+        raise TypeError('the index registry is read-only')
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        if self.specs:
+            return self.registry.iter_specs()
+        else:
+            return self.registry.iter_names()
+
+    def keys(self):
+        return list(self)
+
+    def __repr__(self):
+        return repr(dict(self.iteritems()))
+
+
+REGISTRY = KitRegistry(load_registry())
+
+# Same contents as the variables of the same name in index_definitions,
+# except that INDEX_LOOKUP also accepts specifications in mixed case.
+BASIC_LOOKUP = KitLookup(REGISTRY, False, REGISTRY.payload['basic_count'])
+INDEX_LOOKUP = KitLookup(REGISTRY, True, REGISTRY.payload['index_count'])
+
+
+def resolve(spec):
+    """Return the tuple (kitname, index name) for the index specification.
+    Raise KeyError if it is invalid."""
+    return REGISTRY.resolve(spec)
+
+
+def get_names(sequence):
+    "Return the tuple of names of the indexes having exactly the sequence."
+    try:
+        return REGISTRY.get_sequence_lookup()[len(sequence)][sequence]
+    except KeyError:
+        return ()
+
+def get_lengths():
+    "Return the sorted list of the lengths of the index sequences."
+    return sorted(REGISTRY.get_sequence_lookup())
+
+def get_sequences(length):
+    """Return the dictionary of all index sequences of the given length.
+    Key: sequence, value: tuple of index names. Do not modify it!"""
+    return REGISTRY.get_sequence_lookup().get(length, {})
+
+
+if __name__ == '__main__':
+    payload, signatures = build_registry()
+    write_registry(payload, signatures)
+    print("Wrote %s: %i kits, %i indexes, %i index specifications"
+          % (REGISTRY_FILE, len(payload['kits']),
+             payload['basic_count'], payload['index_count']))
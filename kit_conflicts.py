@@ -0,0 +1,140 @@
+"""Check which index kits can be pooled in one lane.
+
+Two index sequences collide if they are within the given number of
+mismatches, compared up to the length of the shortest of them. The
+collisions form a graph over all index names; its connected components
+are the groups of indexes linked by chains of collisions, and the number
+of collisions between the indexes of two kits tells whether the kits can
+be pooled: they can if it is zero.
+"""
+
+import optparse
+
+import numpy
+
+from samplesheet.index_registry import BASIC_LOOKUP, REGISTRY
+from samplesheet.check_overlap import get_overlaps
+
+
+class CollisionGraph(object):
+    """Graph of the index names in the lookup, with an edge between two
+    names if their sequences are within 'max_mismatches' mismatches."""
+
+    def __init__(self, lookup=BASIC_LOOKUP, registry=REGISTRY,
+                 max_mismatches=2):
+        self.max_mismatches = max_mismatches
+        self.keys, self.mismatches = get_overlaps(lookup)
+        self.adjacency = self.mismatches <= max_mismatches
+        numpy.fill_diagonal(self.adjacency, False)
+        self.kitnames = registry.get_kitnames()
+        positions = dict([(k, p) for p, k in enumerate(self.kitnames)])
+        # Membership matrix; one row per kit, one column per index name.
+        self.membership = numpy.zeros((len(self.kitnames), len(self.keys)),
+                                      dtype=numpy.int32)
+        for pos, key in enumerate(self.keys):
+            self.membership[positions[registry.resolve(key)[0]], pos] = 1
+        self.components = None
+
+    def get_components(self):
+        """Return the list of connected components, as lists of index names,
+        largest first. Names without any collision are not included."""
+        if self.components is None:
+            labels = numpy.zeros(len(self.keys), dtype=numpy.int32)
+            label = 0
+            for start in numpy.flatnonzero(self.adjacency.any(axis=1)):
+                if labels[start]: continue
+                label += 1
+                frontier = numpy.zeros(len(self.keys), dtype=bool)
+                frontier[start] = True
+                while frontier.any():
+                    labels[frontier] = label
+                    frontier = self.adjacency[frontier].any(axis=0) & \
+                        (labels == 0)
+            self.components = [[self.keys[pos]
+                                for pos in numpy.flatnonzero(labels == l)]
+                               for l in xrange(1, label + 1)]
+            self.components.sort(key=len, reverse=True)
+        return self.components
+
+    def get_conflict_counts(self):
+        """Return the matrix of the number of colliding pairs of indexes
+        between the kits, in the order of 'kitnames'. The diagonal gives
+        the number of colliding pairs within each kit."""
+        adjacency = self.adjacency.astype(numpy.int32)
+        result = numpy.dot(numpy.dot(self.membership, adjacency),
+                           self.membership.T)
+        result[numpy.diag_indices_from(result)] /= 2
+        return result
+
+    def get_conflicts(self, kitname1, kitname2):
+        """Return the list of tuples (name1, name2, mismatches) for the
+        colliding pairs of indexes between the two kits."""
+        rows = numpy.flatnonzero(
+            self.membership[self.kitnames.index(kitname1)])
+        cols = numpy.flatnonzero(
+            self.membership[self.kitnames.index(kitname2)])
+        block = self.adjacency[numpy.ix_(rows, cols)]
+        result = []
+        for row, col in zip(*numpy.nonzero(block)):
+            pos1, pos2 = rows[row], cols[col]
+            if kitname1 == kitname2 and pos1 > pos2: continue
+            result.append((self.keys[pos1], self.keys[pos2],
+                           int(self.mismatches[pos1, pos2])))
+        return result
+
+    def can_pool(self, kitname1, kitname2):
+        "Can the two kits be pooled, i.e. are there no collisions between them?"
+        return not self.get_conflicts(kitname1, kitname2)
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser(usage='%prog [options] [KIT1 KIT2]',
+                                   description=__doc__.split('\n\n')[0])
+    parser.add_option('-k', '--mismatches', type='int', default=2,
+                      help='maximum number of mismatches for a collision'
+                      ' (default 2)')
+    parser.add_option('-c', '--components', action='store_true',
+                      default=False,
+                      help='list the connected components')
+    options, args = parser.parse_args()
+    if len(args) not in (0, 2):
+        parser.error('give either no kits or two kits')
+    graph = CollisionGraph(max_mismatches=options.mismatches)
+    args = [a.upper() for a in args]
+    for kitname in args:
+        if kitname not in graph.kitnames:
+            parser.error("no such kit %s" % kitname)
+
+    if args:
+        conflicts = graph.get_conflicts(*args)
+        if conflicts:
+            print("%s and %s cannot be pooled; %i colliding pairs:"
+                  % (args[0], args[1], len(conflicts)))
+            for name1, name2, mismatches in conflicts:
+                print("  %s %s %i" % (name1, name2, mismatches))
+        else:
+            print("%s and %s can be pooled." % tuple(args))
+    else:
+        components = graph.get_components()
+        print("%i collision components at %i mismatches, largest %i indexes"
+              % (len(components), options.mismatches,
+                 components and len(components[0]) or 0))
+        counts = graph.get_conflict_counts()
+        width = max([len(k) for k in graph.kitnames])
+        print('')
+        print("%-*s  %s" % (width + 4, 'Colliding pairs',
+                            ' '.join(["%5i" % (pos + 1) for pos
+                                      in xrange(len(graph.kitnames))])))
+        for pos, (kitname, row) in enumerate(zip(graph.kitnames, counts)):
+            print("%2i  %-*s  %s" % (pos + 1, width, kitname,
+                                     ' '.join(["%5i" % c for c in row])))
+        print('')
+        print('Kits that can be pooled:')
+        for pos1, kitname1 in enumerate(graph.kitnames):
+            for pos2 in xrange(pos1 + 1, len(graph.kitnames)):
+                if counts[pos1, pos2] == 0:
+                    print("  %s %s" % (kitname1, graph.kitnames[pos2]))
+    if options.components:
+        print('')
+        for component in graph.get_components():
+            print(' '.join(component))
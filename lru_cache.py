@@ -0,0 +1,82 @@
+"""Size-bounded least-recently-used cache, with hit and miss counters."""
+
+
+class LRUCache(object):
+    """Mapping of at most 'size' items; when full, the least recently
+    used item is discarded. Access is by 'get' and 'set'.
+    Implemented as a dict and a circular doubly-linked list of
+    [previous, next, key, value] links."""
+
+    def __init__(self, size):
+        if size < 1:
+            raise ValueError('cache size must be at least 1')
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.links = dict()
+        self.root = []
+        self.root[:] = [self.root, self.root, None, None]
+
+    def __len__(self):
+        return len(self.links)
+
+    def __contains__(self, key):
+        return key in self.links
+
+    def get(self, key, default=None):
+        "Return the value for the key, or the default, and count it."
+        try:
+            link = self.links[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._make_newest(link)
+        return link[3]
+
+    def set(self, key, value):
+        "Set the value for the key, discarding the oldest item if full."
+        try:
+            link = self.links[key]
+        except KeyError:
+            if len(self.links) >= self.size:
+                oldest = self.root[1]
+                oldest[0][1] = oldest[1]
+                oldest[1][0] = oldest[0]
+                del self.links[oldest[2]]
+            last = self.root[0]
+            link = [last, self.root, key, value]
+            last[1] = self.root[0] = self.links[key] = link
+        else:
+            link[3] = value
+            self._make_newest(link)
+
+    def discard(self, key):
+        "Remove the item for the key, if any."
+        try:
+            link = self.links.pop(key)
+        except KeyError:
+            return
+        link[0][1] = link[1]
+        link[1][0] = link[0]
+
+    def clear(self):
+        "Remove all items and reset the counters."
+        self.links.clear()
+        self.root[:] = [self.root, self.root, None, None]
+        self.hits = 0
+        self.misses = 0
+
+    def get_stats(self):
+        "Return a dictionary of the size, number of items, hits and misses."
+        return dict(size=self.size, items=len(self.links),
+                    hits=self.hits, misses=self.misses)
+
+    def _make_newest(self, link):
+        "Make the link the most recently used."
+        link[0][1] = link[1]
+        link[1][0] = link[0]
+        last = self.root[0]
+        link[0] = last
+        link[1] = self.root
+        last[1] = self.root[0] = link
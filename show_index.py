@@ -1,6 +1,6 @@
 import pprint
 
-from samplesheet.index_definitions import INDEX_LOOKUP
+from samplesheet.index_registry import INDEX_LOOKUP
 
-pprint.pprint(INDEX_LOOKUP)
+pprint.pprint(dict(INDEX_LOOKUP))
 
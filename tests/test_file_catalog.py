@@ -0,0 +1,132 @@
+"""Tests of the catalog of samplesheet files shared by threads.
+
+Run from the directory containing the package:
+
+    python -m unittest discover -s samplesheet/tests -t .
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from samplesheet.file_catalog import Catalog
+
+try:
+    from samplesheet import wsgi_application
+except ImportError:                     # HyperText or wireframe missing
+    wsgi_application = None
+
+# Seconds to run the threads listing and saving concurrently.
+DURATION = 1.0
+
+# Number of files in the directory at any time.
+FILES = 1000
+
+
+class ConcurrentCatalogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dirpath = tempfile.mkdtemp()
+        self.year = time.localtime()[0]
+        self.yearpath = os.path.join(self.dirpath, str(self.year))
+        os.mkdir(self.yearpath)
+        for number in xrange(-FILES, 0):
+            open(self.get_filepath(number), 'w').write('FCID\n')
+        self.set_unchanged()
+        self.catalog = Catalog(self.dirpath, self.year)
+        self.errors = []
+        # Switch threads as often as possible, to provoke races.
+        self.checkinterval = sys.getcheckinterval()
+        sys.setcheckinterval(1)
+
+    def tearDown(self):
+        sys.setcheckinterval(self.checkinterval)
+        shutil.rmtree(self.dirpath)
+
+    def get_filepath(self, number):
+        return os.path.join(self.yearpath, "FCID%05i.csv" % (number + FILES))
+
+    def set_unchanged(self):
+        """Set the modification time of the directory back to long ago,
+        so that the catalog trusts its listing and updates it in place."""
+        os.utime(self.yearpath, (0, 0))
+
+    def run_threads(self, *targets):
+        "Run the functions concurrently until DURATION has passed."
+        stop = time.time() + DURATION
+
+        def run(target):
+            try:
+                number = 0
+                while time.time() < stop:
+                    target(number)
+                    number += 1
+            except Exception, msg:
+                self.errors.append("%s: %s" % (msg.__class__.__name__, msg))
+
+        threads = [threading.Thread(target=run, args=(t,)) for t in targets]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.errors, [])
+
+    def save(self, number):
+        "Write a new file and replace an older one, as a save does."
+        filepath = self.get_filepath(number)
+        tmppath = filepath + '.tmp'
+        open(tmppath, 'w').write('FCID\n')
+        os.rename(tmppath, filepath)
+        self.set_unchanged()
+        self.catalog.update(filepath)
+        filepath = self.get_filepath(number - FILES)
+        os.remove(filepath)
+        self.set_unchanged()
+        self.catalog.discard(filepath)
+
+    def list(self, number):
+        "List the files and compute the state, as the home page does."
+        entries = self.catalog.get_entries()
+        self.assertTrue(FILES - 1 <= len(entries) <= FILES + 1)
+        self.catalog.get_state()
+
+    def test_list_and_save(self):
+        "Listing the files while saving others does not fail."
+        self.run_threads(self.save, self.list, self.list)
+        fcids = sorted([e[0] for e in self.catalog.get_entries()])
+        self.assertEqual(fcids, sorted([os.path.splitext(f)[0] for f
+                                        in os.listdir(self.yearpath)]))
+
+    @unittest.skipIf(wsgi_application is None, 'HyperText or wireframe missing')
+    def test_home_and_save(self):
+        "Rendering the home page while saving samplesheets does not fail."
+        w = wsgi_application
+        catalog, data_dir = w.CATALOG, w.DATA_DIR
+        w.CATALOG, w.DATA_DIR = self.catalog, self.dirpath
+
+        class Request(object):
+            environ = dict()
+            cgi_fields = dict()
+
+        class Response(dict):
+            def append(self, content):
+                self['content'] = content
+
+        def save(number):
+            w.Samplesheet("FCID%05i" % (number + FILES)).write()
+
+        def home(number):
+            w.home(Request(), Response())
+
+        try:
+            self.run_threads(save, home)
+        finally:
+            w.CATALOG, w.DATA_DIR = catalog, data_dir
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+"""Tests of the compilation of the index registry from kit files,
+and of the time to import it.
+
+Run from the directory containing the package:
+
+    python -m unittest discover -s samplesheet/tests -t .
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from samplesheet import index_registry
+from samplesheet.index_registry import build_registry, compile_registry, \
+    read_kit_file, read_source_kits, SOURCE_FILE
+
+# Number of times to import a module, taking the fastest.
+IMPORT_RUNS = 10
+
+# Print the milliseconds to import the module and whether any of the
+# modules needed only for rebuilding the registry were imported.
+IMPORT_SCRIPT = """
+import sys, time
+start = time.time()
+import samplesheet.%s
+print (time.time() - start) * 1000.0
+print bool(set(['csv', 'json', 'logging']).intersection(sys.modules))
+"""
+
+
+class KitFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dirpath = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dirpath)
+
+    def write_kit_file(self, filename, content):
+        filepath = os.path.join(self.dirpath, filename)
+        with open(filepath, 'w') as outfile:
+            outfile.write(content)
+        return filepath
+
+    def get_sources(self, *filepaths):
+        sources = [((SOURCE_FILE,), read_source_kits(SOURCE_FILE))]
+        sources.extend([((f,), read_kit_file(f)) for f in filepaths])
+        return sources
+
+    def test_repeated_kitname(self):
+        "A kit named as one already in use is rejected."
+        kits = read_source_kits(SOURCE_FILE)
+        kit = [('ILLUMINA', dict(mykit1='ACGTACGT'), 'mykit', ())]
+        self.assertRaises(ValueError, compile_registry, kits + kit)
+
+    def test_skip_repeated_kitname(self):
+        "A kit file named as a kit already in use is skipped."
+        filepath = self.write_kit_file('illumina.csv',
+                                       'Index,Sequence\nmykit1,ACGTACGT\n')
+        expected, signatures = build_registry(self.get_sources())
+        payload, signatures = build_registry(self.get_sources(filepath))
+        kitnames = [k[0] for k in payload['kits']]
+        self.assertEqual(kitnames.count('ILLUMINA'), 1)
+        self.assertEqual(payload['kitdata'], expected['kitdata'])
+        self.assertEqual(payload['basic_count'], expected['basic_count'])
+        registry = index_registry.KitRegistry(payload)
+        for specs, count in [(False, payload['basic_count']),
+                             (True, payload['index_count'])]:
+            lookup = index_registry.KitLookup(registry, specs, count)
+            self.assertEqual(len(lookup), len(list(lookup)))
+        self.assertEqual(registry.resolve('i3'), ('ILLUMINA', 'index3'))
+
+    def test_lower_case_names(self):
+        "The index names of a kit file are converted to lower case."
+        filepath = self.write_kit_file('mykit.csv',
+                                       'Index,Sequence\nMyKit1,acgtacgt\n')
+        self.assertEqual(read_kit_file(filepath),
+                         [('MYKIT', dict(mykit1='ACGTACGT'), 'mykit', ())])
+        filepath = self.write_kit_file('other.json',
+            '{"kit": "other", "indexes": {"OTHER2": "TTGGCCAA"}}')
+        self.assertEqual(read_kit_file(filepath),
+                         [('OTHER', dict(other2='TTGGCCAA'), 'other', ())])
+
+
+class ImportTest(unittest.TestCase):
+
+    def get_import(self, module):
+        """Return the tuple (milliseconds, rebuild modules imported?) for
+        the fastest of the imports of the module in a new process."""
+        env = dict(os.environ)
+        parent = os.path.dirname(os.path.dirname(index_registry.DIRPATH))
+        paths = [parent, env.get('PYTHONPATH')]
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, paths))
+        result = []
+        for run in xrange(IMPORT_RUNS):
+            output = subprocess.check_output([sys.executable, '-c',
+                                              IMPORT_SCRIPT % module], env=env)
+            milliseconds, imported = output.split()
+            result.append((float(milliseconds), imported == 'True'))
+        return min(result)
+
+    def test_import(self):
+        """Importing the valid registry does not import the modules used to
+        rebuild it, and is faster than importing the index definitions."""
+        registry, imported = self.get_import('index_registry')
+        self.assertFalse(imported)
+        definitions, imported = self.get_import('index_definitions')
+        self.assertTrue(registry < definitions,
+                        "registry import %.1f ms, definitions import %.1f ms"
+                        % (registry, definitions))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -15,14 +15,25 @@ import logging
 import os
 import csv
 import re
+import email.utils
+import fcntl
+import hashlib
 from cStringIO import StringIO
 import socket
 import time
 import string
+import threading
 
 from HyperText.HTML40 import *
-from samplesheet.index_definitions import INDEX_LOOKUP
-from samplesheet.annotate_index import hamming_distance, levenshtein_distance
+from samplesheet.index_registry import INDEX_LOOKUP, REGISTRY
+from samplesheet.annotate_index import cached_distance, within
+from samplesheet.index_neighbourhood import MismatchIndex
+from samplesheet.dual_index import DualIndexes, is_dual, is_too_close
+from samplesheet.index_assignment import assign_indexes
+from samplesheet.file_catalog import Catalog
+from samplesheet.lru_cache import LRUCache
+from samplesheet.colour_balance import get_colour_balance_warning, \
+    TWO_COLOUR_CHANNELS
 
 import wireframe.application
 from wireframe.response import *
@@ -38,6 +49,9 @@ TRASH_DIR = os.path.join(DATA_DIR, 'trash')
 
 FIRST_YEAR = 2011
 
+# In-process catalog of the samplesheet files in the yearly directories.
+CATALOG = Catalog(DATA_DIR, FIRST_YEAR)
+
 # Strict set of allowed characters, to match CASAVA requirements
 ALLOWED_CHARS = set(string.ascii_letters + string.digits + '_-')
 
@@ -53,10 +67,22 @@ PROJECTID_RX = re.compile(r'^[A-Z]+__[A-Z][a-zA-Z]+_[0-9]{2,2}_[0-9]{2,2}$')
 # XXX Relaxed regexp: Was considered too sloppy, not used.
 # PROJECTID_RX = re.compile(r'^[A-Z][a-zA-Z_]+_[0-9]{2,2}_[0-9]{2,2}$')
 
+# Maximum number of parsed samplesheets kept in memory.
+RECORDS_CACHE_SIZE = 100
+
+# Number of samplesheets per page of the home page.
+HOME_PAGE_SIZE = 100
+
+# Maximum number of lanes whose index sequence warnings are kept in memory.
+LANE_WARNINGS_CACHE_SIZE = 1000
+
 # Minimum allowed edit distances between index sequences in a lane.
 MIN_HAMMING_DISTANCE = 3
 MIN_LEVENSHTEIN_DISTANCE = 2
 
+# Channels of the sequencing chemistry, for the colour balance check.
+COLOUR_CHANNELS = TWO_COLOUR_CHANNELS
+
 HEADER = ('FCID',
           'Lane',
           'SampleID',
@@ -93,9 +119,27 @@ logging.basicConfig(level=logging.INFO)
 def get_year():
     return time.localtime()[0]
 
+def get_timestamp(mtime):
+    "Return the modification time as a local time string."
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(mtime))
+
+def get_http_date(mtime):
+    "Return the modification time as an HTTP date string."
+    return email.utils.formatdate(mtime, usegmt=True)
+
 def get_url(*parts):
     return '/'.join([URL_BASE] + list(parts))
 
+def get_home_url(year=None, page=1):
+    query = []
+    if year:
+        query.append("year=%i" % year)
+    if page > 1:
+        query.append("page=%i" % page)
+    if query:
+        return get_url() + '?' + '&'.join(query)
+    return get_url()
+
 def get_default(request, field, default=''):
     try:
         value = request.cgi_fields[field].value.strip()
@@ -107,6 +151,38 @@ def get_default(request, field, default=''):
         return value
 
 
+def get_version(content):
+    "Return the version token for the content of a samplesheet file."
+    return hashlib.md5(content).hexdigest()
+
+# Parsed samplesheets; key: (path, mtime, size, inode) of the file,
+# value: tuple (version, records). The records must not be modified.
+RECORDS_CACHE = LRUCache(RECORDS_CACHE_SIZE)
+_records_lock = threading.Lock()
+
+def get_cache_key(filepath, info):
+    "Return the key in RECORDS_CACHE for the file with the given stat info."
+    return (filepath, info.st_mtime, info.st_size, info.st_ino)
+
+def get_cached_records(key):
+    """Return the tuple (version, copy of the records) for the key in
+    RECORDS_CACHE, or None if not there."""
+    with _records_lock:
+        cached = RECORDS_CACHE.get(key)
+    if cached is None: return None
+    return cached[0], [list(r) for r in cached[1]]
+
+def set_cached_records(key, version, records):
+    "Keep a copy of the records in RECORDS_CACHE."
+    records = [list(r) for r in records]
+    with _records_lock:
+        RECORDS_CACHE.set(key, (version, records))
+
+
+class StaleSamplesheet(Exception):
+    "The samplesheet file has been changed since it was read."
+
+
 class Samplesheet(object):
 
     def __init__(self, fcid):
@@ -118,6 +194,7 @@ class Samplesheet(object):
         self.fcid = fcid.upper()
         self.header = []
         self.records = []
+        self.version = None             # Version token of the file read
 
     def __str__(self):
         return "Samplesheet %s" % self.fcid
@@ -130,10 +207,7 @@ class Samplesheet(object):
         try:
             return self._filepath
         except AttributeError:
-            filename = self.fcid +'.csv'
-            for year in range(FIRST_YEAR, get_year() + 1):
-                self._filepath = os.path.join(DATA_DIR, str(year), filename)
-                if os.path.exists(self._filepath): break
+            self._filepath = CATALOG.get_filepath(self.fcid)
             return self._filepath
 
     def get_url(self, *suffixes):
@@ -152,10 +226,9 @@ class Samplesheet(object):
         try:
             return self._mtime
         except AttributeError:
-            if self.exists:
-                mtime = os.path.getmtime(self.filepath)
-                self._mtime = time.strftime("%Y-%m-%d %H:%M:%S",
-                                            time.localtime(mtime))
+            entry = self.fcid and CATALOG.lookup(self.fcid)
+            if entry:
+                self._mtime = get_timestamp(entry[1])
             else:
                 self._mtime = None
             return self._mtime
@@ -163,7 +236,7 @@ class Samplesheet(object):
     @property
     def exists(self):
         if not self.fcid: return False
-        return os.path.exists(self.filepath)
+        return CATALOG.lookup(self.fcid) is not None
 
     def get_content(self):
         return open(self.filepath).read()
@@ -177,11 +250,33 @@ class Samplesheet(object):
         self.fix_records()
 
     def read(self):
+        """Read the records from file, or from the cache if the file has
+        not been changed since parsed."""
         try:
-            infile = open(self.filepath, 'rU')
-        except OSError:
+            infile = open(self.filepath, 'rb')
+        except (IOError, OSError):
             raise HTTP_NOT_FOUND("no such %s" % self)
-        reader = csv.reader(infile)
+        try:
+            # The key must be for the file opened, not one replacing it.
+            key = get_cache_key(self.filepath, os.fstat(infile.fileno()))
+            cached = get_cached_records(key)
+            if cached is None:
+                content = infile.read()
+        finally:
+            infile.close()
+        if cached is None:
+            self.parse(content)
+            set_cached_records(key, self.version, self.records)
+        else:
+            self.header = HEADER[:]     # Use fresh header
+            self.version, self.records = cached
+
+    def parse(self, content):
+        "Set the records from the content of a file."
+        self.version = get_version(content)
+        # Universal newlines, as for mode 'rU'.
+        content = content.replace('\r\n', '\n').replace('\r', '\n')
+        reader = csv.reader(StringIO(content))
         reader.next()                   # Skip past header
         self.header = HEADER[:]         # Use fresh header
         self.records = [record for record in reader if len(record)] # Skip empty
@@ -221,19 +316,71 @@ class Samplesheet(object):
         self.records.sort(key=lambda r: (r[1], r[2]))
 
     def write(self):
-        "Save the records to file."
+        """Save the records to file. The file is replaced atomically by
+        a new file, so that a reader never sees a partially written one.
+        If the samplesheet was read from file, raise StaleSamplesheet if
+        the file has been changed since then."""
         dirpath = os.path.dirname(self.filepath)
         if not os.path.exists(dirpath):
             os.mkdir(dirpath)
-        outfile = open(self.filepath, 'wb')
-        writer = csv.writer(outfile)
+        outfile = StringIO()
         writer = csv.writer(outfile, quoting=csv.QUOTE_MINIMAL)
         writer.writerow(self.header)
         for record in self.records:
             # Copy over data to 'SampleProject' from 'Description'.
             record[9] = record[5]
             writer.writerow(record)
-        outfile.close()
+        content = outfile.getvalue()
+        tmppath = "%s.%i.tmp" % (self.filepath, os.getpid())
+        outfile = open(tmppath, 'wb')
+        try:
+            outfile.write(content)
+            outfile.flush()
+            info = os.fstat(outfile.fileno()) # Same after the rename
+        finally:
+            outfile.close()
+        # Lock the current file while checking and replacing it. Another
+        # writer waiting for the lock will then find the new file changed.
+        try:
+            lockfile = open(self.filepath, 'rb')
+        except IOError:                 # New file
+            lockfile = None
+        try:
+            if lockfile is not None:
+                try:
+                    fcntl.flock(lockfile, fcntl.LOCK_EX)
+                except IOError:         # Not supported by the file system
+                    pass
+            if self.version is not None and \
+               self.version != self.get_current_version():
+                os.remove(tmppath)
+                raise StaleSamplesheet(str(self))
+            os.rename(tmppath, self.filepath)
+        finally:
+            if lockfile is not None:
+                lockfile.close()
+        self.version = get_version(content)
+        # Cache the records as they will be read back from the file.
+        written = Samplesheet(self.fcid)
+        written.parse(content)
+        set_cached_records(get_cache_key(self.filepath, info),
+                           written.version, written.records)
+        CATALOG.update(self.filepath)
+        try:
+            del self._mtime
+        except AttributeError:
+            pass
+
+    def get_current_version(self):
+        "Return the version token of the file, or None if there is none."
+        try:
+            infile = open(self.filepath, 'rb')
+        except IOError:
+            return None
+        try:
+            return get_version(infile.read())
+        finally:
+            infile.close()
 
 
 def cleanup_identifier(identifier):
@@ -276,25 +423,145 @@ def interpret_sampleid_for_index(sampleid, append_a=False):
     return result
 
 
-def get_samplesheets():
-    "Return list of all samplesheets in reverse chronological order."
+def get_lane_index_warning(seqindex, lane_index, lane_duals, lane_sampleids):
+    """Return a warning if the index sequence is identical or too close
+    to an index sequence already in the lane, else None.
+    The lane index is a mismatch index of the index sequences in the lane,
+    the lane duals the set of its dual index sequences, and the lane
+    sampleids a dict of their SampleIDs."""
+    if seqindex in lane_sampleids:
+        return 'Index sequence already used in lane.'
+    # Dual indexes are too close only if all index reads are too close,
+    # as the demultiplexer matches each read separately.
+    if is_dual(seqindex):
+        hamming = dict(lane_duals.hamming_distances(seqindex))
+        levenshtein = lane_duals.levenshtein_close(seqindex,
+                                                   MIN_LEVENSHTEIN_DISTANCE-1)
+        for other_seqindex in sorted(hamming, key=lambda o: lane_sampleids[o]):
+            other_sampleid = lane_sampleids[other_seqindex]
+            if other_seqindex in levenshtein:
+                return ('Too small Levenshtein distance between the index'
+                        ' reads of this index sequence and sample %s'
+                        ' in lane.' % other_sampleid)
+            if is_too_close(hamming[other_seqindex], MIN_HAMMING_DISTANCE):
+                return ('Too small Hamming distance between the index'
+                        ' reads of this index sequence and sample %s'
+                        ' in lane.' % other_sampleid)
+        others = []
+    else:
+        # The neighbourhood probe gives the other sequences of equal length
+        # within too small a Hamming distance. For equal lengths the
+        # Levenshtein distance is less than 2 only if the Hamming distance
+        # is, so this suffices as long as MIN_LEVENSHTEIN_DISTANCE is at
+        # most 2.
+        others = lane_index.get(seqindex).items()
+        others.sort(key=lambda o: (o[1], lane_sampleids[o[0]]))
+    # Other sequences are compared as strings, up to the shortest.
+    for other_seqindex in sorted(lane_sampleids):
+        if is_dual(other_seqindex):
+            if is_dual(seqindex): continue      # Compared per read above
+        elif not is_dual(seqindex) and len(other_seqindex) == len(seqindex):
+            continue                            # Found by the probe above
+        others.append((other_seqindex,
+                       cached_distance(seqindex, other_seqindex,
+                                       shortest=True)))
+    for other_seqindex, hd in others:
+        other_sampleid = lane_sampleids[other_seqindex]
+        if within(seqindex, other_seqindex, MIN_LEVENSHTEIN_DISTANCE-1,
+                  shortest=True):
+            return ('Too small Levenshtein distance between this index'
+                    ' sequence and sample %s in lane.' % other_sampleid)
+        if hd < MIN_HAMMING_DISTANCE:
+            return ('Too small Hamming distance between this index'
+                    ' sequence and sample %s in lane.' % other_sampleid)
+    return None
+
+# Index sequence warnings of lanes; key: tuple of the tuples (index sequence,
+# SampleID) of the lane, value: list of the warnings, or None, for them.
+LANE_WARNINGS_CACHE = LRUCache(LANE_WARNINGS_CACHE_SIZE)
+_lane_warnings_lock = threading.Lock()
+
+def get_lane_index_warnings(lane):
+    """Return the list of the warnings, or None, for the index sequences
+    in the lane, given as a list of tuples (index sequence, SampleID).
+    Each index sequence is checked against those before it in the lane.
+    The warnings are kept in LANE_WARNINGS_CACHE, so that the checks are
+    done again only for a lane that has changed."""
+    key = tuple(lane)
+    with _lane_warnings_lock:
+        result = LANE_WARNINGS_CACHE.get(key)
+    if result is not None: return list(result)
+    lane_index = MismatchIndex(max_mismatches=MIN_HAMMING_DISTANCE-1)
+    lane_duals = DualIndexes()
+    lane_sampleids = dict()
+    result = []
+    for seqindex, sampleid in key:
+        result.append(get_lane_index_warning(seqindex,
+                                             lane_index,
+                                             lane_duals,
+                                             lane_sampleids))
+        if seqindex not in lane_sampleids:
+            if is_dual(seqindex):
+                lane_duals.add(seqindex)
+            else:
+                lane_index.add(seqindex)
+            lane_sampleids[seqindex] = sampleid
+    with _lane_warnings_lock:
+        LANE_WARNINGS_CACHE.set(key, result)
+    return list(result)
+
+
+def assign_lane_indexes(samplesheet, lane, kitnames):
+    """Assign index sequences from the kits to the samples without one
+    in the lane, keeping the distances to the others as large as possible,
+    and save the samplesheet. Return a message on the outcome."""
+    records = [r for r in samplesheet.records if r[1] == lane]
+    unassigned = [r for r in records if not r[4]]
+    if not unassigned:
+        return "No samples without index sequence in lane %i." % lane
+    if not kitnames:
+        return 'No kits selected for assigning indexes.'
+    try:
+        assignments, distance = assign_indexes(
+            len(unassigned), kitnames,
+            fixed=[r[4] for r in records if r[4]],
+            min_hamming=MIN_HAMMING_DISTANCE,
+            min_levenshtein=MIN_LEVENSHTEIN_DISTANCE)
+    except ValueError, msg:
+        return "Could not assign indexes in lane %i: %s." % (lane, msg)
+    for record, (name, sequence) in zip(unassigned, assignments):
+        # Add the index spec to the SampleID, unless it has a suffix.
+        if SAMPLEID_RX.match(record[2]):
+            record[2] = "%s_%s" % (record[2], name)
+        record[4] = sequence
+    samplesheet.write()
+    if distance is None:
+        return "Assigned %i index in lane %i." % (len(assignments), lane)
+    return ("Assigned %i indexes in lane %i; minimum Hamming distance %i."
+            % (len(assignments), lane, distance))
+
+
+def get_samplesheets(year=None, entries=None):
+    """Return list of all samplesheets, or those of the given year,
+    in reverse chronological order. The entries for all files, as given
+    by the catalog, are used if given, else obtained from it."""
     sheets = []
-    for year in range(FIRST_YEAR, get_year() + 1):
-        dirpath = os.path.join(DATA_DIR, str(year))
-        if not os.path.exists(dirpath): continue
-        for filename in os.listdir(dirpath):
-            if not filename.endswith('.csv'): continue
-            fcid = os.path.splitext(os.path.basename(filename))[0]
-            sheets.append(Samplesheet(fcid))
-    sheets.sort()
+    if entries is None:
+        entries = CATALOG.get_entries(year=year)
+    elif year is not None:
+        entries = [e for e in entries if CATALOG.get_year(e[1]) == year]
+    entries = sorted(entries, key=lambda e: e[2])
+    for fcid, filepath, mtime in entries:
+        sheet = Samplesheet(fcid)
+        sheet._filepath = filepath
+        sheet._mtime = get_timestamp(mtime)
+        sheets.append(sheet)
     sheets.reverse()
     return sheets
 
 def invalid_data_dir(request, response):
     "Check whether the DATA_DIR exists and is readable."
-    try:
-        os.listdir(DATA_DIR)
-    except OSError, msg:
+    if not CATALOG.is_readable():
         response['Content-Type'] = 'text/html'
         response.append(str(HTML(HEAD(TITLE('Error')),
                                  BODY(H1('Error'),
@@ -303,13 +570,57 @@ def invalid_data_dir(request, response):
         return True
         
 
+def is_not_modified(request, etag, mtime):
+    """Does the conditional GET request show that the client already has
+    the current version of the page?"""
+    if_none_match = request.environ.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        tags = [t.strip() for t in if_none_match.split(',')]
+        return '*' in tags or etag in tags or ('W/' + etag) in tags
+    if_modified_since = request.environ.get('HTTP_IF_MODIFIED_SINCE')
+    if if_modified_since:
+        parsed = email.utils.parsedate_tz(if_modified_since.split(';')[0])
+        if parsed:
+            return int(mtime) <= email.utils.mktime_tz(parsed)
+    return False
+
 def home(request, response):
     if invalid_data_dir(request, response): return
+    try:
+        year = int(get_default(request, 'year'))
+    except ValueError:
+        year = None
+    try:
+        page = max(1, int(get_default(request, 'page', default='1')))
+    except ValueError:
+        page = 1
+    # The page depends only on the files and the query. The directories
+    # are checked once for both the ETag and the page.
+    entries, digest, modified = CATALOG.get_listing()
+    etag = '"%s"' % hashlib.md5("%s %s %s %s" % (digest, year, page,
+                                                 HOME_PAGE_SIZE)).hexdigest()
+    if is_not_modified(request, etag, modified):
+        raise HTTP_NOT_MODIFIED(ETag=etag)
+    sheets = get_samplesheets(year=year, entries=entries)
+    pages = max(1, (len(sheets) + HOME_PAGE_SIZE - 1) / HOME_PAGE_SIZE)
+    page = min(page, pages)
     rows = [TR(TH('Samplesheet'),
                TH('Modified'))]
-    for sheet in get_samplesheets():
+    for sheet in sheets[(page - 1) * HOME_PAGE_SIZE:page * HOME_PAGE_SIZE]:
         rows.append(TR(TD(A(sheet.fcid, href=sheet.url)),
                        TD(sheet.mtime)))
+    years = ['Year: ', year is None and B('All') or A('All', href=get_home_url())]
+    for found in range(FIRST_YEAR, get_year() + 1):
+        if found == year:
+            years.extend([' ', B(str(found))])
+        else:
+            years.extend([' ', A(str(found), href=get_home_url(found))])
+    pager = ["Page %i of %i (%i samplesheets)" % (page, pages, len(sheets))]
+    if page > 1:
+        pager.extend([' ', A('Previous', href=get_home_url(year, page - 1))])
+    if page < pages:
+        pager.extend([' ', A('Next', href=get_home_url(year, page + 1))])
+    navigation = DIV(P(*years), P(*pager))
     info = DIV('Follow the instructions in the Google document ',
                B('10249 To create a samplesheet for demultiplexing HiSeq runs.'),
                P('Comments or questions to Per Kraulis (',
@@ -332,12 +643,16 @@ def home(request, response):
                  action=get_url())
     table = TABLE(*rows)
     response['Content-Type'] = 'text/html'
+    response['ETag'] = etag
+    response['Last-Modified'] = get_http_date(modified)
+    response['Cache-Control'] = 'no-cache'
     title = 'Samplesheet editor'
     response.append(str(HTML(HEAD(TITLE(title)),
                              BODY(H1(title),
                                   info,
                                   P(form1),
                                   P(form2),
+                                  navigation,
                                   P(table)))))
 
 def create(request, response):
@@ -383,8 +698,6 @@ def view(request, response, xfer_msg=None):
                 TH('Recipe'),
                 TH('Operator'))
     rows = []
-    # Key: lane number, value: tuple (seq index, SampleID)
-    seqindex_lookup = dict()
     # Figure out whether that extra A has been appended previously.
     append_a = None
     for record in samplesheet.records:
@@ -392,6 +705,22 @@ def view(request, response, xfer_msg=None):
             append_a = len(record[4]) > 6 and record[4][-1] == 'A'
     if append_a is None:
         append_a = False
+    # Key: lane number, value: positions of the records with index sequence.
+    lane_positions = dict()
+    for pos, record in enumerate(samplesheet.records):
+        if record[4]:
+            lane_positions.setdefault(record[1], []).append(pos)
+    # Key: record position, value: warning for its index sequence in the lane.
+    index_warnings = dict()
+    # Key: lane number, value: colour balance warning for its index reads,
+    # which is shown once for the lane, not for each record.
+    colour_warnings = dict()
+    for lane, positions in lane_positions.iteritems():
+        records = [samplesheet.records[pos] for pos in positions]
+        index_warnings.update(zip(positions, get_lane_index_warnings(
+            [(r[4], r[2]) for r in records])))
+        colour_warnings[lane] = get_colour_balance_warning(
+            [r[4].upper() for r in records], channels=COLOUR_CHANNELS)
     # Require same index sequence length within each lane.
     index_sequence_lengths = [None] * 9     # 1-based index for max 8 lanes.
     for pos, record in enumerate(samplesheet.records):
@@ -421,28 +750,8 @@ def view(request, response, xfer_msg=None):
             else:
                 if index_sequence_lengths[lane] != len(record[4]):
                     sample_warning.append('Unequal length of index sequence in lane.')
-            other_seqindices = seqindex_lookup.get(lane, set())
-            if record[4] in other_seqindices:
-                sample_warning.append('Index sequence already used in lane.')
-            else:
-                for other_seqindex, other_sampleid in other_seqindices:
-                    ld = levenshtein_distance(record[4], other_seqindex,
-                                              shortest=True)
-                    if ld < MIN_LEVENSHTEIN_DISTANCE:
-                        sample_warning.append('Too small Levenshtein distance'
-                                              ' between this index sequence'
-                                              ' and sample %s in lane.'
-                                              % other_sampleid)
-                        break
-                    hd = hamming_distance(record[4], other_seqindex,
-                                          shortest=True)
-                    if hd < MIN_HAMMING_DISTANCE:
-                        sample_warning.append('Too small Hamming distance'
-                                              ' between this index sequence'
-                                              ' and sample %s in lane.'
-                                              % other_sampleid)
-                        break
-                seqindex_lookup.setdefault(lane, set()).add((record[4], record[2]))
+            if index_warnings[pos]:
+                sample_warning.append(index_warnings[pos])
             indexseq = interpret_sampleid_for_index(record[2], append_a)
             if indexseq and indexseq != record[4]:
                 sample_warning.append('SampleID and index sequence inconsistent.')
@@ -579,6 +888,16 @@ def view(request, response, xfer_msg=None):
                                  name='sort', value='default'),
                            method='POST',
                            action=samplesheet.url))),
+                TR(TD(FORM(INPUT(type='submit',
+                                 value='Assign indexes'),
+                           ' to samples without index in lane ',
+                           SELECT(name='assign_lane',
+                                  *[OPTION(str(i)) for i in xrange(1, 9)]),
+                           ' from kits ',
+                           SELECT(name='assign_kits', multiple=True, size=4,
+                                  *[OPTION(k) for k in REGISTRY.get_kitnames()]),
+                           method='POST',
+                           action=samplesheet.url))),
                 TR(TD(FORM(INPUT(type='submit',
                                  value='Delete this samplesheet',
                                  onclick="return confirm('Really delete?');"),
@@ -596,10 +915,15 @@ def view(request, response, xfer_msg=None):
         problems = sorted(problems)
         problems = ', '.join(map(str, problems))
         warning.append(P("There are problems regarding records %s!" % problems))
+    for lane, colour_warning in sorted(colour_warnings.items()):
+        if colour_warning:
+            warning.append(P("Lane %i: %s" % (lane, colour_warning)))
     warning = DIV(style='color: red;', *warning)
     form = FORM(P(INPUT(type='submit', value='Save'),
                   ' Store the samplesheet. The pipeline computer (comicbookguy)'
                   ' will fetch it automatically within 15 minutes.'),
+                INPUT(type='hidden',
+                      name='version', value=samplesheet.version),
                 P(table),
                 method='POST',
                 action=samplesheet.url)
@@ -614,9 +938,27 @@ def view(request, response, xfer_msg=None):
 
 def update(request, response):
     if invalid_data_dir(request, response): return
+    try:
+        _update(request, response)
+    except StaleSamplesheet:
+        view(request, response,
+             xfer_msg='The samplesheet was changed by someone else after'
+             ' you loaded it. Your changes have NOT been saved; redo them'
+             ' in this current version.')
+
+def _update(request, response):
     samplesheet = Samplesheet(request.path_named_values['fcid'])
     samplesheet.read()
 
+    # Reject a save from the form of an earlier version of the file.
+    try:
+        version = request.cgi_fields['version'].value
+    except KeyError:
+        pass
+    else:
+        if version != samplesheet.version:
+            raise StaleSamplesheet(str(samplesheet))
+
     # Sort existing records
     try:
         request.cgi_fields['sort']
@@ -628,6 +970,19 @@ def update(request, response):
         view(request, response)
         return
 
+    # Assign index sequences to the samples without one in a lane
+    try:
+        lane = int(request.cgi_fields['assign_lane'].value)
+    except KeyError:
+        pass
+    except ValueError:
+        raise HTTP_BAD_REQUEST('invalid lane')
+    else:
+        kitnames = request.cgi_fields.getlist('assign_kits')
+        message = assign_lane_indexes(samplesheet, lane, kitnames)
+        view(request, response, xfer_msg=message)
+        return
+
     # Cut-and-paste from Google Docs spreadsheet
     try:
         cutandpaste = request.cgi_fields['cutandpaste'].value
@@ -809,6 +1164,7 @@ def delete(request, response):
     samplesheet = Samplesheet(request.path_named_values['fcid'])
     os.rename(samplesheet.filepath,
               os.path.join(TRASH_DIR, samplesheet.fcid + '.csv'))
+    CATALOG.discard(samplesheet.filepath)
     raise HTTP_SEE_OTHER(Location=get_url())
 
 